@@ -0,0 +1,516 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+Asyncio versions of :py:class:`aboutyou.api.Api` and
+:py:class:`aboutyou.shop.ShopApi`.
+
+.. note::
+
+    This module needs Python 3.5 or newer.
+    The requests are send directly, proxies are not supported.
+
+.. code-block:: python
+
+    >>> async def main():
+    ...     async with AsyncApi(credentials) as api:
+    ...         tree, products = await asyncio.gather(api.categorytree(),
+    ...                                               api.products([227838]))
+    ...
+    >>> asyncio.get_event_loop().run_until_complete(main())
+"""
+import asyncio
+import json
+import logging
+import ssl
+import time
+import urllib.parse
+
+from .api import MAX_IDS, Api, ApiException, chunks, merge_lists
+from .config import Config
+from .pool import PoolException, pool_options, proxy_for
+from .shop import Product, Search, ShopApi
+
+
+class AsyncConnectionPool(object):
+    """
+    Keeps alive non-blocking HTTP/1.1 connections per endpoint.
+
+    A pool can be shared by several :py:class:`aboutyou.aio.AsyncApi`
+    instances, but only within one event loop.
+
+    :param int maxsize: The maximum of idle connections kept per endpoint.
+    :param int idle: Seconds after which an idle connection is closed.
+    :param int timeout: The timeout for a request in seconds.
+    """
+    def __init__(self, maxsize=10, idle=60, timeout=30):
+        self.maxsize = maxsize
+        self.idle = idle
+        self.timeout = timeout
+
+        self.__connections = {}
+
+        self.log = logging.getLogger("aboutyou.aio.pool")
+
+    def __key(self, url):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        return (scheme, parts.hostname, port), path
+
+    async def __acquire(self, key):
+        now = time.time()
+        idle = self.__connections.get(key, [])
+
+        while idle:
+            reader, writer, last = idle.pop()
+
+            if now - last > self.idle or reader.at_eof():
+                writer.close()
+            else:
+                return reader, writer, True
+
+        scheme, host, port = key
+
+        self.log.debug('connect %s://%s:%s', scheme, host, port)
+
+        context = ssl.create_default_context() if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context),
+                                                self.timeout)
+
+        return reader, writer, False
+
+    def __release(self, key, reader, writer):
+        idle = self.__connections.setdefault(key, [])
+
+        if len(idle) < self.maxsize:
+            idle.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    async def __status(self, reader):
+        line = await reader.readline()
+
+        if not line:
+            raise ConnectionResetError("connection closed by server")
+
+        return line
+
+    async def __response(self, reader, line):
+        version, status, reason = (line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+
+                if size == 0:
+                    # skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+
+        return int(status), reason, keep_alive, data
+
+    async def request(self, url, body, headers, retry=True):
+        """
+        POSTs the body to the url and returns the raw response body.
+
+        See :py:func:`aboutyou.pool.ConnectionPool.request`.
+
+        :param str url: The url to post to.
+        :param bytes body: The request body.
+        :param dict headers: The request headers.
+        :param bool retry: False for requests, which must not be send twice.
+        :returns: The response body as bytes.
+        :raises PoolException: If the server answers with an error status.
+        """
+        key, path = self.__key(url)
+
+        head = ["POST {} HTTP/1.1".format(path),
+                "Host: {}".format(key[1]),
+                "Content-Length: {}".format(len(body)),
+                "Connection: keep-alive"]
+        head += ["{}: {}".format(name, value) for name, value in headers.items()]
+        message = ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+        loop = asyncio.get_event_loop()
+
+        while True:
+            reader, writer, reused = await self.__acquire(key)
+            deadline = loop.time() + self.timeout
+
+            try:
+                writer.write(message)
+                await writer.drain()
+
+                line = await asyncio.wait_for(self.__status(reader), self.timeout)
+            except asyncio.TimeoutError:
+                # on 3.11 a TimeoutError is an OSError, it is never retried
+                writer.close()
+                raise
+            except OSError:
+                # the connection was closed before any byte of a response
+                writer.close()
+
+                if reused and retry:
+                    self.log.debug('stale connection to %s:%s', key[1], key[2])
+                    continue
+
+                raise
+            except BaseException:
+                writer.close()
+                raise
+
+            try:
+                status, reason, keep_alive, data = await asyncio.wait_for(self.__response(reader, line),
+                                                                          max(0, deadline - loop.time()))
+            except BaseException:
+                writer.close()
+                raise
+
+            if keep_alive:
+                self.__release(key, reader, writer)
+            else:
+                writer.close()
+
+            if status >= 400:
+                raise PoolException(url, status, reason, None, data)
+
+            return data
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        for idle in self.__connections.values():
+            for reader, writer, last in idle:
+                writer.close()
+
+        self.__connections = {}
+
+
+class AsyncApi(Api):
+    """
+    The asyncio version of :py:class:`aboutyou.api.Api`.
+
+    All commands are coroutines and have the same parameters
+    as in :py:class:`aboutyou.api.Api`.
+
+    :param credentials: The app credentials.
+    :param config: default Config, A Config instance.
+    :param pool: An :py:class:`aboutyou.aio.AsyncConnectionPool` to share.
+
+    .. code-block:: python
+
+        >>> api = AsyncApi(credentials)
+        >>> result = await api.product_search('s3ss10n', filter={"categories": [16354]})
+    """
+    def __init__(self, credentials, config=Config(), pool=None):
+        super(AsyncApi, self).__init__(credentials, config)
+
+        if pool is None:
+            options = pool_options(self.config)
+
+            if options is None:
+                # every request on a new connection
+                options = dict(Config.PARAMS["pool"], maxsize=0)
+
+            pool = AsyncConnectionPool(**options)
+
+        self.pool = pool
+        self.__inflight = {}
+
+        if proxy_for(self.endpoint) is not None:
+            self.log.warning('AsyncApi does not use the proxy %s', proxy_for(self.endpoint))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.pool.clear()
+
+    async def request(self, params):
+        """
+        Posts the raw JSON string to the endpoint.
+
+        :param str params: The JSON request.
+        :returns: The raw JSON response as string.
+        """
+        response = await self.pool.request(self.endpoint, params.encode('utf-8'), self.headers(),
+                                           retry=self._idempotent(params))
+
+        return response.decode('utf-8')
+
+    async def send(self, cmd, obj):
+        """
+        See :py:func:`aboutyou.api.Api.send`.
+        """
+        try:
+            params = json.dumps([{cmd: obj}], sort_keys=True)
+
+            if self.flights is None or cmd in Api.MUTATING:
+                result = await self.__call(cmd, params)
+            else:
+                future = self.__inflight.get(params)
+
+                if future is None:
+                    future = asyncio.ensure_future(self.__call(cmd, params))
+                    future.add_done_callback(lambda unused: self.__inflight.pop(params, None))
+                    self.__inflight[params] = future
+
+                # a cancelled caller must not cancel the request of the others
+                result = await asyncio.shield(future)
+
+            if "error_message" in result:
+                self.log.error(result["error_message"])
+                raise ApiException(result["error_message"])
+
+            return result
+
+        except Exception:
+            self.log.exception('')
+            raise
+
+    async def __call(self, cmd, params):
+        return json.loads(await self.request(params))[0][cmd]
+
+    async def send_many(self, commands):
+        """
+        See :py:func:`aboutyou.api.Api.send_many`.
+        """
+        try:
+            params = json.dumps([{cmd: obj} for cmd, obj in commands])
+
+            return self._split_results(commands, await self.request(params))
+
+        except Exception:
+            self.log.exception('')
+            raise
+
+    def batch(self):
+        raise ApiException("use send_many to batch commands with AsyncApi")
+
+    async def _fanout(self, func, parts, merge):
+        workers = asyncio.Semaphore(self.config.workers or Config.PARAMS["workers"])
+
+        async def call(part):
+            async with workers:
+                return await func(part)
+
+        return merge(await asyncio.gather(*[call(part) for part in parts]))
+
+    async def facets_all(self, group_ids=None, limit=MAX_IDS):
+        """
+        See :py:func:`aboutyou.api.Api.facets_all`.
+
+        The pages after the first one are fetched concurrently.
+
+        :returns: A list of the pages as lists of facets, in order.
+
+        .. code-block:: python
+
+            >>> for page in await api.facets_all([FACET.BRAND]):
+            ...     print(len(page))
+        """
+        first = await self.facets(group_ids, limit=limit, offset=0)
+        page = first["facet"]
+
+        # the server can send less facets per page than asked for
+        if len(page) == 0:
+            return [page]
+
+        offsets = list(range(len(page), first["hits"], len(page)))
+
+        if len(offsets) == 0:
+            return [page]
+
+        responses = await self._fanout(lambda offset: self.facets(group_ids, limit=limit, offset=offset),
+                                       offsets, list)
+
+        return [page] + [response["facet"] for response in responses]
+
+    async def basket_dispose(self, sessionid):
+        """
+        Deletes all items in the basket.
+
+        :param sessionid: The session associated with the basket.
+        """
+        data = await self.basket_get(sessionid)
+
+        if len(data['order_lines']) > 0:
+            vids = [order['id'] for order in data['order_lines']]
+
+            await self.basket_remove(sessionid, vids)
+
+    async def child_apps(self):
+        """
+        See :py:func:`aboutyou.api.Api.child_apps`.
+        """
+        data = await self.send('child_apps', None)
+
+        return data['child_apps']
+
+    async def order(self, sessionid, success_url, cancel_url=None, error_url=None):
+        """
+        See :py:func:`aboutyou.api.Api.order`.
+        """
+        response = await self.send("initiate_order", self._order_params(sessionid, success_url, cancel_url, error_url))
+
+        return self._order_url(sessionid, response)
+
+    async def product_eans(self, eans, fields=None):
+        """
+        See :py:func:`aboutyou.api.Api.product_eans`.
+        """
+        if len(eans) > MAX_IDS:
+            return await self._fanout(lambda part: self.product_eans(part, fields), chunks(eans), merge_lists)
+
+        response = await self.send("products_eans", self._product_eans_params(eans, fields))
+
+        return response["eans"]
+
+
+class AsyncShopApi(ShopApi):
+    """
+    The asyncio version of :py:class:`aboutyou.shop.ShopApi`.
+
+    The coroutines :py:func:`load`, :py:func:`products_by_id`,
+    :py:func:`products_by_ean`, :py:func:`search` and :py:func:`gather`
+    use :py:class:`aboutyou.aio.AsyncApi`, which is available as *aio*.
+    All other methods are inherited and stay blocking, this includes the
+    auto fetching of the returned :py:class:`aboutyou.shop.Product`
+    instances, which is done with the blocking *api*.
+
+    :param credentials: A :py:class:`aboutyou.config.Credentials` instance.
+    :param config: A :py:class:`aboutyou.config.Config` instance.
+    :param pool: An :py:class:`aboutyou.aio.AsyncConnectionPool` to share.
+
+    .. code-block:: python
+
+        >>> shop = AsyncShopApi(credentials)
+        >>> await shop.load()
+        >>> products, with_error = await shop.products_by_id([237188, 123])
+    """
+    def __init__(self, credentials, config=Config(), pool=None):
+        super(AsyncShopApi, self).__init__(credentials, config)
+
+        self.aio = AsyncApi(self.credentials, self.config, pool)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.aio.pool.clear()
+
+    async def load(self):
+        """
+        Loads the category tree and the facets concurrently, so the
+        category and facet lookups do not block afterwards.
+        """
+        tree = self.cache_get('categorytree')
+        facets = self.cache_get('facets')
+
+        if tree is None or facets is None:
+            self.log.info('get category tree and facets from Api')
+
+            tree, facettypes, response = await asyncio.gather(self.aio.categorytree(),
+                                                              self.aio.facettypes(),
+                                                              self.aio.facets([]))
+            facets = response["facet"]
+
+            self.cache_set('categorytree', tree)
+            self.cache_set('facettypes', facettypes)
+            self.cache_set('facets', facets)
+
+        self._build_categories(tree)
+        self._build_facets(facets)
+
+    async def products_by_id(self, pids, fields=['sale', 'active', 'default_variant']):
+        """
+        See :py:func:`aboutyou.shop.ShopApi.products_by_id`.
+        """
+        products, spid = self._cached_products(pids)
+        withError = {}
+
+        if len(spid) > 0:
+            response = await self.aio.products(ids=spid, fields=list(fields))
+            self._add_products(response, products, withError)
+
+        return products, withError
+
+    async def products_by_ean(self, eans, fields=None):
+        """
+        See :py:func:`aboutyou.shop.ShopApi.products_by_ean`.
+        """
+        response = await self.aio.product_eans(eans=eans, fields=fields)
+
+        return [Product(self, p) for p in response]
+
+    async def search(self, sessionid, filter=None, result=None):
+        """
+        See :py:func:`aboutyou.shop.ShopApi.search`.
+
+        The products of the search can be fetched without blocking
+        by :py:func:`gather`.
+        """
+        if result is None:
+            result = {}
+
+        result["limit"] = 0
+        result["offset"] = 0
+
+        obj = await self.__product_search(sessionid, filter, result)
+
+        return Search(self, sessionid, filter, result, obj)
+
+    async def gather(self, search, offset, limit):
+        """
+        Fetches a page of products of a search.
+
+        :param search: A :py:class:`aboutyou.shop.Search` instance.
+        :param int offset: The position of the first product.
+        :param int limit: The amount of products.
+        :returns: A list of :py:class:`aboutyou.shop.Product`.
+        """
+        result = dict(search.result, offset=offset, limit=limit)
+        response = await self.__product_search(search.sessionid, search.filter, result)
+
+        return search.products._products(response)
+
+    async def __product_search(self, sessionid, filter, result):
+        key, response = self._search_lookup(filter, result)
+
+        if response is None:
+            response = await self.aio.product_search(sessionid, filter=filter, result=result)
+            self._search_store(key, response)
+
+        return response
@@ -5,6 +5,9 @@
 import json
 import logging
 import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
 
 if sys.version[0] == '2':
     import urllib2
@@ -13,6 +16,7 @@ else:
 
 from .constants import TYPE
 from .config import Config
+from .pool import ConnectionPool, pool_options, proxy_for
 
 
 Api_VERSION = "1.1"
@@ -25,6 +29,9 @@ AUTHORS = [
     "Arne Simon [arne_simon@slice-dice.de]"
 ]
 
+MAX_IDS = 200
+"""The maximum of ids the Api accepts in one command."""
+
 
 class ApiException(Exception):
     """An exception in the Api api."""
@@ -42,6 +49,109 @@ def check_sessionid(sessionid):
         raise ApiException("The session id must have at least 5 characters")
 
 
+def chunks(items, size=MAX_IDS):
+    """
+    Splits a list into lists of at most *size* items.
+    """
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def merge_ids(key):
+    """
+    Returns a function, which merges the dicts under *key* of several responses.
+    """
+    def merge(responses):
+        result = dict(responses[0])
+        result[key] = {}
+
+        for response in responses:
+            result[key].update(response[key])
+
+        return result
+
+    return merge
+
+
+def merge_dicts(responses):
+    result = {}
+
+    for response in responses:
+        result.update(response)
+
+    return result
+
+
+def merge_lists(responses):
+    result = []
+
+    for response in responses:
+        result += response
+
+    return result
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent calls with the same key share one execution.
+
+    The first caller of a key runs the function, all callers arriving
+    while it runs wait for it and get the same result or exception.
+
+    .. code-block:: python
+
+        >>> flights = SingleFlight()
+        >>> flights.do('category_tree', lambda: api.request(params))
+    """
+    class Call(object):
+        __slots__ = ('done', 'result', 'error')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__calls = {}
+
+    def __len__(self):
+        return len(self.__calls)
+
+    def do(self, key, func):
+        """
+        :param key: The key of the call.
+        :param func: The function to call without arguments.
+        :returns: The result of *func*.
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = SingleFlight.Call()
+                self.__calls[key] = call
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as ex:
+            call.error = ex
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+            call.done.set()
+
+
 class Api(object):
     """
     An interface to the Api API.
@@ -52,6 +162,19 @@ class Api(object):
     :param credentials: The app credentials.
     :param config: default Config, A Config instance.
 
+    .. note::
+
+        By default all requests go through a keep-alive
+        :py:class:`aboutyou.pool.ConnectionPool`, see the *pool* option
+        of :py:class:`aboutyou.config.Config`. Behind a proxy of the
+        *http_proxy* or *https_proxy* environment variables the requests
+        are send by *urlopen*. Error responses raise an
+        :py:class:`urllib.error.HTTPError` either way.
+
+        Concurrent identical commands share one request and its result,
+        see the *coalesce* option. The commands in *MUTATING* are always send
+        and never repeated on a stale connection.
+
     .. rubric:: Example
 
     .. code-block:: python
@@ -99,6 +222,9 @@ class Api(object):
         }
     """
 
+    MUTATING = frozenset(["basket", "initiate_order"])
+    """The commands which change something and are never coalesced."""
+
     def __init__(self, credentials, config=Config()):
         self.credentials = credentials
         self.config = config
@@ -110,15 +236,61 @@ class Api(object):
 
         logname = "aboutyou.api.{}".format(self.credentials.app_id)
         self.log = logging.getLogger(logname)
+
+        self.pool = None
+
+        options = pool_options(self.config)
+
+        if options is not None:
+            if proxy_for(self.__endpoint) is None:
+                self.pool = ConnectionPool(**options)
+            else:
+                # urlopen talks to the proxy
+                self.log.info('use proxy %s', proxy_for(self.__endpoint))
+
+        self.flights = None
+
+        if self.config.coalesce is not False:
+            self.flights = SingleFlight()
+
         self.log.debug("instantiated")
 
-    def request(self, params):
-        headers = {
+    @property
+    def endpoint(self):
+        """
+        The url of the API endpoint.
+        """
+        return self.__endpoint
+
+    def headers(self):
+        """
+        The HTTP headers for a request.
+        """
+        return {
             "Content-Type": "text/plain;charset=UTF-8",
             "User-Agent": self.config.agent,
             "Authorization": self.credentials.authorization,
         }
 
+    def request(self, params):
+        """
+        Posts the raw JSON string to the endpoint.
+
+        :param str params: The JSON request.
+        :returns: The raw JSON response as string.
+        """
+        headers = self.headers()
+
+        if self.pool is not None:
+            retry = self._idempotent(params)
+
+            if sys.version[0] == '2':
+                return self.pool.request(self.__endpoint, params, headers, retry=retry)
+            else:
+                response = self.pool.request(self.__endpoint, bytes(params, 'utf-8'), headers, retry=retry)
+
+                return str(response, 'utf-8')
+
         if sys.version[0] == '2':
             req = urllib2.Request(self.__endpoint, params, headers)
             response = urllib2.urlopen(req)
@@ -130,6 +302,14 @@ class Api(object):
 
             return str(response.read(), 'utf-8')
 
+    def _idempotent(self, params):
+        """
+        :param str params: The JSON request.
+        :returns: False if the request has a command of *MUTATING*,
+                  which must not be send twice.
+        """
+        return not any(cmd in Api.MUTATING for command in json.loads(params) for cmd in command)
+
     def send(self, cmd, obj):
         """
         Sends a Pyhton structure of dict's and list's as raw JSON to aboutyou and
@@ -141,9 +321,13 @@ class Api(object):
         :raises ApiException: If there is a general error in the message.
         """
         try:
-            params = json.dumps([{cmd: obj}])
-            result = self.request(params)
-            result = json.loads(result, encoding="utf-8")[0][cmd]
+            # sorted keys make identical commands identical requests
+            params = json.dumps([{cmd: obj}], sort_keys=True)
+
+            if self.flights is None or cmd in Api.MUTATING:
+                result = self.__call(cmd, params)
+            else:
+                result = self.flights.do(params, lambda: self.__call(cmd, params))
 
             if "error_message" in result:
                 self.log.error(result["error_message"])
@@ -155,6 +339,86 @@ class Api(object):
             self.log.exception('')
             raise
 
+    def __call(self, cmd, params):
+        return json.loads(self.request(params))[0][cmd]
+
+    def send_many(self, commands):
+        """
+        Sends several commands in one request.
+
+        :param list commands: A list of tuples (<command name>, <request parameters>).
+        :returns: A list with the result of each command, in the same order.
+                  A command which failed is represented by an
+                  :py:class:`aboutyou.api.ApiException` instead of its result.
+        :raises ApiException: If the response does not fit to the commands.
+
+        .. code-block:: python
+
+            >>> api.send_many([("category_tree", {}), ("facet_types", {})])
+        """
+        try:
+            params = json.dumps([{cmd: obj} for cmd, obj in commands])
+
+            return self._split_results(commands, self.request(params))
+
+        except Exception:
+            self.log.exception('')
+            raise
+
+    def _split_results(self, commands, response):
+        response = json.loads(response)
+
+        if len(response) != len(commands):
+            raise ApiException("got {} results for {} commands".format(len(response), len(commands)))
+
+        results = []
+
+        for (cmd, obj), answer in zip(commands, response):
+            result = answer.get(cmd)
+
+            if result is None:
+                result = ApiException("no result for {}".format(cmd))
+            elif "error_message" in result:
+                self.log.error(result["error_message"])
+                result = ApiException(result["error_message"])
+
+            results.append(result)
+
+        return results
+
+    def batch(self):
+        """
+        Collects commands to send them in one request.
+
+        :returns: A :py:class:`aboutyou.api.Batch` instance.
+
+        .. code-block:: python
+
+            >>> with api.batch() as batch:
+            ...     products = batch.products([227838, 287677])
+            ...     tree = batch.categorytree()
+            ...
+            >>> products.result()["ids"]
+        """
+        return Batch(self)
+
+    def _fanout(self, func, parts, merge):
+        """
+        Calls *func* for each part with at most *config.workers* threads
+        and merges the results.
+        """
+        workers = min(len(parts), self.config.workers or Config.PARAMS["workers"])
+
+        self.log.debug('fan out %s parts on %s workers', len(parts), workers)
+
+        pool = ThreadPool(workers)
+
+        try:
+            return merge(pool.map(func, parts))
+        finally:
+            pool.close()
+            pool.join()
+
     def javascript_url(self):
         """
         Returns the url to the Aboutyou Javascript helper functions.
@@ -311,6 +575,21 @@ class Api(object):
             }
 
         """
+        return self.basket_update(sessionid, add=variants)
+
+    def basket_update(self, sessionid, add=None, remove=None):
+        """
+        Adds and removes basket items in one request.
+
+        :param str sessionid: identification of the basket -> user, user -> basket
+        :param list add: The items to add like in :py:func:`basket_set`.
+        :param list remove: The ids of the items to remove like in :py:func:`basket_remove`.
+        :returns: The basket JSON.
+
+        .. code-block:: python
+
+            >>> api.basket_update('someid', add=[('my4813891', 4813891)], remove=['my4813890'])
+        """
         check_sessionid(sessionid)
 
         def build(var):
@@ -322,9 +601,12 @@ class Api(object):
                 # return {'id':var[0], 'variant_id':var[1]}
                 return {'id':var[0], 'variant_id':var[1], 'additional_data': var[2]}
 
+        lines = [{"delete": str(vid)} for vid in remove or []]
+        lines += [build(var) for var in add or []]
+
         data = {
             "session_id": sessionid,
-            "order_lines": [build(var) for var in variants]
+            "order_lines": lines
         }
 
         # self.log.debug(json.dumps(data, indent=4))
@@ -509,17 +791,10 @@ class Api(object):
                 "total_net": 3360
             }
         """
-        check_sessionid(sessionid)
-
         if len(variants) < 1:
             raise ApiException('No ids submitted.')
 
-        data = {"session_id": sessionid,
-                "order_lines": [{"delete": str(vid)} for vid in variants]}
-
-        # self.log.debug(json.dumps(data, indent=4))
-
-        return self.send("basket", data)
+        return self.basket_update(sessionid, remove=variants)
 
     def basket_dispose(self, sessionid):
         """
@@ -738,6 +1013,47 @@ class Api(object):
 
         return self.send("facets", facets)
 
+    def facets_all(self, group_ids=None, limit=MAX_IDS):
+        """
+        Pages through all facets, the pages after the first one are
+        fetched in parallel by at most *config.workers* threads.
+
+        :param list group_ids: get only these group ids, if None get all.
+        :param int limit: The count of facets per page.
+        :returns: A generator of the pages as lists of facets, in order.
+
+        .. code-block:: python
+
+            >>> for page in api.facets_all([FACET.BRAND]):
+            ...     for facet in page:
+            ...         print facet["name"]
+        """
+        first = self.facets(group_ids, limit=limit, offset=0)
+        page = first["facet"]
+
+        yield page
+
+        # the server can send less facets per page than asked for
+        if len(page) == 0:
+            return
+
+        offsets = list(range(len(page), first["hits"], len(page)))
+
+        if len(offsets) == 0:
+            return
+
+        workers = min(len(offsets), self.config.workers or Config.PARAMS["workers"])
+
+        self.log.debug('fetch %s facet pages on %s workers', len(offsets), workers)
+
+        pool = ThreadPool(workers)
+
+        try:
+            for response in pool.imap(lambda offset: self.facets(group_ids, limit=limit, offset=offset), offsets):
+                yield response["facet"]
+        finally:
+            pool.terminate()
+
     def facettypes(self):
         """
         This query returns a list of facet groups available.
@@ -803,6 +1119,11 @@ class Api(object):
                               exceptions (see checkout api)
         :returns: An url to the shop.
         """
+        response = self.send("initiate_order", self._order_params(sessionid, success_url, cancel_url, error_url))
+
+        return self._order_url(sessionid, response)
+
+    def _order_params(self, sessionid, success_url, cancel_url, error_url):
         check_sessionid(sessionid)
 
         order = {"session_id": sessionid, "success_url": success_url}
@@ -813,8 +1134,9 @@ class Api(object):
         if error_url is not None:
             order["error_url"] = error_url
 
-        response = self.send("initiate_order", order)
+        return order
 
+    def _order_url(self, sessionid, response):
         # the url in response["url"] seems to be invalid !!!
 
         params = '?user_token={}&app_token={}&basketId={}&appId={}'
@@ -829,8 +1151,9 @@ class Api(object):
         This is as "live" as possible.
         And could differ vs. a "product search" or "product" query.
 
-        :param list ids: Anarray of minimum one up to two hundred product variant ids.
-        :raises ApiException: If the id count is not between 1 and 200.
+        :param list ids: An array of product variant ids. More than two hundred
+                         ids are requested in parallel chunks.
+        :raises ApiException: If there is no id.
 
         .. code-block:: python
 
@@ -852,8 +1175,8 @@ class Api(object):
         if idscount < 1:
             raise ApiException("too few ids")
 
-        if idscount > 200:
-            raise ApiException("too many ids")
+        if idscount > MAX_IDS:
+            return self._fanout(self.live_variant, chunks(ids), merge_dicts)
 
         return self.send("live_variant", {"ids": ids})
 
@@ -862,9 +1185,10 @@ class Api(object):
         Here you get a detail view of a product or a list of products returned
         by its ids.
 
-        :param list ids: array of product id
+        :param list ids: array of product id, more than two hundred ids are
+                         requested in parallel chunks and merged into one result
         :param list fields: list of field names
-        :raises ApiException: If the id count is not between 1 and 200.
+        :raises ApiException: If there is no id.
 
         .. rubric:: Possible Field Options
 
@@ -940,8 +1264,8 @@ class Api(object):
         if count < 1:
             raise ApiException("too few ids")
 
-        if count > 200:
-            raise ApiException("too many ids")
+        if count > MAX_IDS:
+            return self._fanout(lambda part: self.products(part, fields), chunks(ids), merge_ids("ids"))
 
         products["ids"] = ids
 
@@ -954,10 +1278,18 @@ class Api(object):
         """
         Returns products by eans.
 
-        :param list eans: An array of eans.
+        :param list eans: An array of eans, more than two hundred eans are
+                          requested in parallel chunks.
         :param list fields: An array of product fields.
         :returns: Array of products.
+        :raises ApiException: If there is no ean.
         """
+        if len(eans) > MAX_IDS:
+            return self._fanout(lambda part: self.product_eans(part, fields), chunks(eans), merge_lists)
+
+        return self.send("products_eans", self._product_eans_params(eans, fields))["eans"]
+
+    def _product_eans_params(self, eans, fields):
         products = {}
 
         count = len(eans)
@@ -965,7 +1297,7 @@ class Api(object):
         if count < 1:
             raise ApiException("too few eans")
 
-        if count > 200:
+        if count > MAX_IDS:
             raise ApiException("too many eans")
 
         # Api wants eans as strings
@@ -974,7 +1306,7 @@ class Api(object):
         if fields is not None:
             products["fields"] = fields
 
-        return self.send("products_eans", products)["eans"]
+        return products
 
     def product_search(self, sessionid, filter=None, result=None):
         """
@@ -1163,3 +1495,124 @@ class Api(object):
             suggest["limit"] = limit
 
         return self.send("suggest", suggest)
+
+
+class BatchResult(object):
+    """
+    The placeholder for the result of a command in a
+    :py:class:`aboutyou.api.Batch`.
+
+    Items can be looked up before the batch is sent,
+    ``batch.child_apps()['child_apps']`` is again a BatchResult.
+    """
+    def __init__(self, batch, index, path=()):
+        self.batch = batch
+        self.index = index
+        self.path = path
+
+    def __getitem__(self, key):
+        return BatchResult(self.batch, self.index, self.path + (key,))
+
+    def result(self):
+        """
+        Returns the result of the command and sends the batch, if it was not
+        send yet.
+
+        :raises ApiException: If the command failed.
+        """
+        result = self.batch.results()[self.index]
+
+        if isinstance(result, Exception):
+            raise result
+
+        for key in self.path:
+            result = result[key]
+
+        return result
+
+
+class Batch(Api):
+    """
+    Collects the commands of an :py:class:`aboutyou.api.Api` and sends them
+    in one request.
+
+    All commands return a :py:class:`aboutyou.api.BatchResult` instead of
+    the result. The batch is send on leaving the *with* block, on the
+    first call to :py:func:`aboutyou.api.BatchResult.result` or by
+    :py:func:`aboutyou.api.Batch.send`.
+    An error in one command does not affect the other commands.
+
+    :param api: The :py:class:`aboutyou.api.Api` to send the commands with.
+
+    .. code-block:: python
+
+        >>> batch = api.batch()
+        >>> products = batch.products([227838], fields=["variants"])
+        >>> facets = batch.facets([FACET.COLOR])
+        >>> basket = batch.basket_get('s3ss10n')
+        >>> batch.send()
+        >>> products.result()
+    """
+    def __init__(self, api):
+        self.api = api
+        self.credentials = api.credentials
+        self.config = api.config
+        self.log = api.log
+
+        self.commands = []
+        self.__results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.__results is None:
+            self.send()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def send(self, cmd=None, obj=None):
+        """
+        Without arguments, sends all collected commands.
+        Otherwise the command is added to the batch.
+
+        :returns: A list of the results or an
+                  :py:class:`aboutyou.api.BatchResult` for an added command.
+        :raises ApiException: If the batch was already send.
+        """
+        if self.__results is not None:
+            raise ApiException("batch was already send")
+
+        if cmd is None:
+            if len(self.commands) > 0:
+                self.__results = self.api.send_many(self.commands)
+            else:
+                self.__results = []
+
+            return self.__results
+
+        self.commands.append((cmd, obj))
+
+        return BatchResult(self, len(self.commands) - 1)
+
+    def results(self):
+        """
+        :returns: A list with the result or exception of each command.
+        """
+        if self.__results is None:
+            self.send()
+
+        return self.__results
+
+    def _fanout(self, func, parts, merge):
+        raise ApiException("to many ids for a batch, maximum is {}".format(MAX_IDS))
+
+    def facets_all(self, group_ids=None, limit=MAX_IDS):
+        raise ApiException("facets_all can not be batched")
+
+    def basket_dispose(self, sessionid):
+        raise ApiException("basket_dispose can not be batched")
+
+    def order(self, sessionid, success_url, cancel_url=None, error_url=None):
+        raise ApiException("order can not be batched")
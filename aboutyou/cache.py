@@ -0,0 +1,410 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+Helpers for the cache of :py:class:`aboutyou.shop.ShopApi`.
+"""
+import bz2
+import json
+import logging
+import marshal
+import sys
+import threading
+import zlib
+
+from collections import OrderedDict
+from time import time as timer
+
+if sys.version[0] == '2':
+    import Queue as queue
+else:
+    import queue
+
+
+class CacheException(Exception):
+    pass
+
+
+class Codec(object):
+    """
+    Encodes values for the cache.
+
+    Every encoded value starts with a one byte tag, which names the format
+    of the rest. So the codec can be changed, without invalidating the
+    entries already in the cache. Values written by older versions, which
+    used bz2 compressed JSON, are still decoded.
+
+    :param str name: *none* for plain JSON, *zlib* for zlib compressed JSON
+                     or *marshal* for the compact binary marshal format,
+                     which is compressed with zlib too. The marshal format
+                     differs between python versions, so it is only for
+                     in-process caches.
+    :param int level: The zlib compression level from 1 (fast) to 9 (small).
+    :param int threshold: Values smaller than this many bytes are not compressed.
+
+    .. code-block:: python
+
+        >>> codec = Codec('zlib', level=1, threshold=256)
+        >>> codec.decode(codec.encode({'id': 123}))
+        {'id': 123}
+    """
+    JSON = b'j'
+    ZLIB_JSON = b'z'
+    MARSHAL = b'm'
+    ZLIB_MARSHAL = b'n'
+
+    NAMES = set(['none', 'zlib', 'marshal'])
+
+    def __init__(self, name='zlib', level=1, threshold=256):
+        if name not in Codec.NAMES:
+            raise CacheException("unknown codec {}".format(name))
+
+        self.name = name
+        self.level = level
+        self.threshold = threshold
+
+    @classmethod
+    def from_config(cls, cache):
+        """
+        Creates the codec for the *cache* option of a
+        :py:class:`aboutyou.config.Config`, which can have the keys
+        *codec*, *level* and *threshold*.
+        """
+        options = {}
+
+        for key, option in [('codec', 'name'), ('level', 'level'), ('threshold', 'threshold')]:
+            if cache and cache.get(key) is not None:
+                options[option] = cache[key]
+
+        return cls(**options)
+
+    def encode(self, value):
+        """
+        :returns: The encoded value as bytes.
+        """
+        if self.name == 'marshal':
+            data = marshal.dumps(value)
+            plain, compressed = Codec.MARSHAL, Codec.ZLIB_MARSHAL
+        else:
+            data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+            plain, compressed = Codec.JSON, Codec.ZLIB_JSON
+
+        if self.name == 'none' or len(data) < self.threshold:
+            return plain + data
+
+        return compressed + zlib.compress(data, self.level)
+
+    def decode(self, data):
+        """
+        :returns: The value of the encoded data.
+        """
+        tag = data[:1]
+
+        if tag == Codec.JSON:
+            return json.loads(data[1:].decode('utf-8'))
+        elif tag == Codec.ZLIB_JSON:
+            return json.loads(zlib.decompress(data[1:]).decode('utf-8'))
+        elif tag == Codec.MARSHAL:
+            return marshal.loads(data[1:])
+        elif tag == Codec.ZLIB_MARSHAL:
+            return marshal.loads(zlib.decompress(data[1:]))
+        elif data[:3] == b'BZh':
+            return json.loads(bz2.decompress(data).decode('utf-8'))
+        else:
+            raise CacheException("unknown cache format")
+
+
+class LocalCache(object):
+    """
+    A size bounded in-process LRU cache with the part of the
+    :py:class:`pylibmc.Client` interface, which is used by
+    :py:class:`aboutyou.shop.ShopApi`. It is safe to use from several threads.
+
+    The values are the already encoded bytes, so the byte budget is exact
+    and a value can not be changed by the code which got it.
+
+    :param int maxsize: The maximum count of entries.
+    :param int maxbytes: The maximum of bytes of all values.
+    :param int ttl: Seconds an entry lives, 0 means until it is evicted.
+
+    .. code-block:: python
+
+        >>> cache = LocalCache(maxsize=10000, maxbytes=64*1024*1024, ttl=300)
+        >>> cache.set('123', b'...')
+        >>> cache.stats()
+        {'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'evictions': 0, 'entries': 1, 'bytes': 3}
+    """
+    def __init__(self, maxsize=10000, maxbytes=64 * 1024 * 1024, ttl=0):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __remove(self, key):
+        value, expires = self.__entries.pop(key)
+        self.__bytes -= len(value)
+
+    def __lookup(self, key, now):
+        entry = self.__entries.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires = entry
+
+        if expires and expires < now:
+            self.__bytes -= len(value)
+            self.misses += 1
+            return None
+
+        # the most recently used entry is the last one
+        self.__entries[key] = entry
+        self.hits += 1
+
+        return value
+
+    def __store(self, key, value, time, now):
+        if key in self.__entries:
+            self.__remove(key)
+
+        if len(value) > self.maxbytes:
+            return
+
+        ttl = min(t for t in (self.ttl, time, float('inf')) if t)
+        expires = now + ttl if ttl != float('inf') else 0
+
+        self.__entries[key] = (value, expires)
+        self.__bytes += len(value)
+
+        while len(self.__entries) > self.maxsize or self.__bytes > self.maxbytes:
+            oldest = next(iter(self.__entries))
+            self.__remove(oldest)
+            self.evictions += 1
+
+    def get(self, key):
+        with self.__lock:
+            return self.__lookup(key, timer())
+
+    def set(self, key, value, time=0):
+        with self.__lock:
+            self.__store(key, value, time, timer())
+
+        return True
+
+    def get_multi(self, keys):
+        now = timer()
+        found = {}
+
+        with self.__lock:
+            for key in keys:
+                value = self.__lookup(key, now)
+
+                if value is not None:
+                    found[key] = value
+
+        return found
+
+    def set_multi(self, mapping, time=0):
+        now = timer()
+
+        with self.__lock:
+            for key, value in mapping.items():
+                self.__store(key, value, time, now)
+
+        return []
+
+    def delete(self, key):
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+                return True
+
+        return False
+
+    def flush_all(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self):
+        """
+        :returns: A dict with the counters hits, misses and evictions,
+                  the hit rate and the current count of entries and bytes.
+        """
+        with self.__lock:
+            lookups = self.hits + self.misses
+
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self.__entries),
+                    'bytes': self.__bytes}
+
+
+class TieredCache(object):
+    """
+    Puts a :py:class:`aboutyou.cache.LocalCache` in front of a remote cache
+    like memcached. Hits of the remote cache are copied into the local one.
+
+    :param local: The :py:class:`aboutyou.cache.LocalCache`.
+    :param remote: The remote cache, for example a :py:class:`pylibmc.Client`.
+    """
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key):
+        value = self.local.get(key)
+
+        if value is None:
+            value = self.remote.get(key)
+
+            if value is not None:
+                self.local.set(key, value)
+
+        return value
+
+    def set(self, key, value, time=0):
+        self.local.set(key, value, time)
+
+        return self.remote.set(key, value, time=time)
+
+    def get_multi(self, keys):
+        found = self.local.get_multi(keys)
+        missing = [key for key in keys if key not in found]
+
+        if missing:
+            remote = self.remote.get_multi(missing)
+            self.local.set_multi(remote)
+            found.update(remote)
+
+        return found
+
+    def set_multi(self, mapping, time=0):
+        self.local.set_multi(mapping, time)
+
+        return self.remote.set_multi(mapping, time=time)
+
+    def delete(self, key):
+        self.local.delete(key)
+
+        return self.remote.delete(key)
+
+    def stats(self):
+        """
+        :returns: The stats of the local cache.
+        """
+        return self.local.stats()
+
+
+class ClientPool(object):
+    """
+    Shares a :py:class:`pylibmc.Client` between threads.
+
+    A pylibmc client must not be used by two threads at the same time,
+    so every call reserves one of *size* clones of the client
+    and waits, if all are in use.
+
+    :param client: The :py:class:`pylibmc.Client` to clone.
+    :param int size: The count of clients.
+
+    .. code-block:: python
+
+        >>> cache = ClientPool(pylibmc.Client(['127.0.0.1']), size=10)
+        >>> cache.get_multi(['123', '456'])
+    """
+    def __init__(self, client, size=10):
+        self.__clients = queue.LifoQueue()
+        self.__clients.put(client)
+
+        for i in range(size - 1):
+            self.__clients.put(client.clone())
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            client = self.__clients.get()
+
+            try:
+                return getattr(client, name)(*args, **kwargs)
+            finally:
+                self.__clients.put(client)
+
+        return call
+
+
+class WriteBehind(object):
+    """
+    Collects cache writes and passes them in batches to a background thread.
+
+    :param write: A function which gets a dict of the values by their keys,
+                  like :py:func:`aboutyou.shop.ShopApi.cache_set_many`.
+    :param float interval: The seconds between two writes.
+    :param int batch: Writes earlier, if this many values are waiting.
+    """
+    def __init__(self, write, interval=1.0, batch=500):
+        self.write = write
+        self.interval = interval
+        self.batch = batch
+
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__wakeup = threading.Event()
+        self.__thread = None
+
+        self.log = logging.getLogger("aboutyou.cache")
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def put(self, mapping):
+        """
+        Queues the values for the next write.
+
+        :param dict mapping: The values by their keys.
+        """
+        if len(mapping) == 0:
+            return
+
+        with self.__lock:
+            self.__pending.update(mapping)
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="aboutyou-write-behind")
+                self.__thread.daemon = True
+                self.__thread.start()
+
+            if len(self.__pending) >= self.batch:
+                self.__wakeup.set()
+
+    def flush(self):
+        """
+        Writes all waiting values now.
+        """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = {}
+
+        if pending:
+            self.write(pending)
+
+    def __run(self):
+        while True:
+            self.__wakeup.wait(self.interval)
+            self.__wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                self.log.exception('')
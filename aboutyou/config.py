@@ -83,7 +83,56 @@ class Config(object):
                              the Iframe. This URL may be changed in future, so please use this method instead
                              of hardcoding the URL into your HTML template.
     :param auto_fetch: If set True, EasyApi fetches automaticly missing fields.
+    :param sibling_fetch: If set True, auto fetching a field of a product of
+                          a search result fetches it for the whole page.
     :param cache: An dict {'hosts': ['server:11202'], 'timeout': 600}.
+                  Optional keys are *codec* ('none', 'zlib' or 'marshal'),
+                  the zlib *level* and the *threshold* in bytes below which
+                  values are stored uncompressed. The *marshal* codec is
+                  only used without *hosts*, because its format differs
+                  between python versions. *clients* is the count of
+                  memcached clients shared by all threads (default 10).
+                  With *local* {'maxsize': 10000, 'maxbytes': 67108864, 'ttl': 300}
+                  an in-process LRU cache is put in front of memcached.
+                  *search* False disables caching the products of search
+                  results and *write_behind* writes them every so many
+                  seconds in a background thread.
+    :param search_cache: An dict {'ttl': 10, 'maxsize': 1000} for an in-process
+                         cache of search responses, which are shared between
+                         all sessions for *ttl* seconds.
+    :param snapshot: An dict {'path': '/var/cache/aboutyou.snapshot',
+                     'max_age': 86400, 'refresh': True}. The category tree
+                     and the facets are read on start from the snapshot file,
+                     if it is not older than *max_age* seconds. With *refresh*
+                     they are renewed from the Api in a background thread,
+                     which writes the snapshot file again.
+    :param str facet_fetch: *all* gets all facets on the first use of a facet
+                            group, *group* gets every group on its own,
+                            when it is used the first time.
+    :param basket_store: An dict {'type': 'sqlite', 'path': 'baskets.db'} for
+                         the store of the basket states, which are shared by
+                         all processes. The *type* is *memory*, *sqlite* or
+                         *memcached*, which uses the *hosts* of the cache
+                         option, if there are no own *hosts*, and shares
+                         *clients* connections between the threads.
+    :param basket_pricing: An dict {'tax': 19.0}, if set the basket totals
+                           are calculated locally and the basket changes are
+                           send in the background. *tax* is the rate for
+                           variants, which were not in the basket before.
+    :param live: An dict {'interval': 60, 'rate': 5} for the background poll
+                 of the live stock and price of variants. All variants are
+                 polled every *interval* seconds with at most *rate*
+                 requests per second.
+    :param pool: An dict {'maxsize': 10, 'idle': 60, 'timeout': 30} for the
+                 keep-alive connection pool, which holds up to *maxsize* idle
+                 connections per endpoint and closes them after *idle* seconds.
+                 If set to *False* every request opens a new connection.
+    :param bool coalesce: If not *False*, concurrent identical read commands
+                          share one request and its result.
+    :param int workers: The maximum of parallel requests, when a command
+                        is split into several requests.
+    :param int readahead: The count of search result pages, which are fetched
+                          in parallel while iterating over all products.
     :param dict logging: A dictonary for logging.config.dictConfig.
     """
     PARAMS = {"stage_url": "http://ant-core-staging-s-api1.wavecloud.de/api",
@@ -94,7 +143,18 @@ class Config(object):
               "shop_url": "https://checkout.aboutyou.de/",
               "javascript_url":  "http://devcenter.dev/appjs/{}.js",
               "auto_fetch": True,
+              "sibling_fetch": False,
               "cache": None,
+              "search_cache": None,
+              "snapshot": None,
+              "facet_fetch": "all",
+              "basket_store": None,
+              "basket_pricing": None,
+              "live": None,
+              "pool": {"maxsize": 10, "idle": 60, "timeout": 30},
+              "workers": 4,
+              "coalesce": True,
+              "readahead": 0,
               "logging": None}
 
     def __init__(self, **kwargs):
@@ -205,4 +265,7 @@ class JSONEnvironmentFallbackConfig(Config):
             logging.config.dictConfig(self.data["logging"])
 
     def __getattr__(self, name):
+        if name not in self.data and name in Config.PARAMS:
+            return Config.PARAMS[name]
+
         return self.data[name]
@@ -66,6 +66,7 @@ class PRODUCT_FIELD:
     DEFAULT_VARIANT = "default_variant"
     DEFAULT_IMAGE = "default_image"
     CATEGORIES = "categories"
+    STYLES = "styles"
 
     ALL = set([VARIANTS,
                DESCRIPTION_LONG,
@@ -74,4 +75,5 @@ class PRODUCT_FIELD:
                MAX_PRICE, SALE,
                DEFAULT_VARIANT,
                DEFAULT_IMAGE,
-               CATEGORIES,])
\ No newline at end of file
+               CATEGORIES,
+               STYLES,])
\ No newline at end of file
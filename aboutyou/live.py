@@ -0,0 +1,243 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+A background poller for the live stock and price of variants.
+
+The registered variant ids are requested by
+:py:func:`aboutyou.api.Api.live_variant` in chunks of two hundred ids.
+The stock and price of every variant are kept in two arrays, so a lookup
+does not cost a request.
+
+.. code-block:: python
+
+    >>> poller = LivePoller(api, interval=60)
+    >>> poller.register([4760437, 4760438])
+    >>> poller.subscribe(lambda event, vid, old, new: print(event, vid))
+    >>> poller.start()
+    >>> poller.stock(4760437)
+    999
+"""
+import logging
+import threading
+import time
+
+from array import array
+
+from .api import MAX_IDS, chunks
+
+
+UNKNOWN = -1
+"""The value of a stock or price, which was not polled yet."""
+
+
+class LivePoller(object):
+    """
+    Polls the live data of the registered variants.
+
+    The subscribers are called with *(event, variant id, old, new)*,
+    where old and new are the stocks or the prices.
+
+    :param api: The :py:class:`aboutyou.api.Api` to use.
+    :param float interval: The seconds between two polls of all variants.
+    :param float rate: The maximum of requests per second, None for no limit.
+    :param int batch: The count of ids per request.
+    """
+    STOCK_OUT = 'stock_out'
+    BACK_IN_STOCK = 'back_in_stock'
+    PRICE_DROP = 'price_drop'
+    PRICE_RISE = 'price_rise'
+
+    EVENTS = (STOCK_OUT, BACK_IN_STOCK, PRICE_DROP, PRICE_RISE)
+
+    def __init__(self, api, interval=60, rate=None, batch=MAX_IDS):
+        self.api = api
+        self.interval = interval
+        self.rate = rate
+        self.batch = batch
+
+        self.__lock = threading.Lock()
+        self.__slots = {}
+        self.__ids = array('l')
+        self.__stock = array('l')
+        self.__price = array('l')
+
+        self.__subscribers = []
+
+        self.__stop = threading.Event()
+        self.__thread = None
+
+        self.log = logging.getLogger("aboutyou.live")
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def __contains__(self, vid):
+        return vid in self.__slots
+
+    def register(self, ids):
+        """
+        Adds variants to the poll.
+
+        :param list ids: The variant ids.
+        """
+        with self.__lock:
+            for vid in ids:
+                if vid not in self.__slots:
+                    self.__slots[vid] = len(self.__ids)
+                    self.__ids.append(vid)
+                    self.__stock.append(UNKNOWN)
+                    self.__price.append(UNKNOWN)
+
+    def unregister(self, ids):
+        """
+        Removes variants from the poll.
+
+        :param list ids: The variant ids.
+        """
+        with self.__lock:
+            for vid in ids:
+                slot = self.__slots.pop(vid, None)
+
+                if slot is None:
+                    continue
+
+                # the last variant takes the free slot
+                last = len(self.__ids) - 1
+
+                if slot != last:
+                    self.__ids[slot] = self.__ids[last]
+                    self.__stock[slot] = self.__stock[last]
+                    self.__price[slot] = self.__price[last]
+                    self.__slots[self.__ids[slot]] = slot
+
+                self.__ids.pop()
+                self.__stock.pop()
+                self.__price.pop()
+
+    def stock(self, vid):
+        """
+        :returns: The last polled stock of the variant or None.
+        """
+        return self.__get(self.__stock, vid)
+
+    def price(self, vid):
+        """
+        :returns: The last polled price of the variant or None.
+        """
+        return self.__get(self.__price, vid)
+
+    def __get(self, table, vid):
+        with self.__lock:
+            slot = self.__slots.get(vid)
+
+            if slot is None or table[slot] == UNKNOWN:
+                return None
+
+            return table[slot]
+
+    def subscribe(self, callback, events=None):
+        """
+        :param callback: A function *(event, variant id, old, new)*.
+        :param events: The events to get, default are all :py:attr:`EVENTS`.
+        """
+        self.__subscribers.append((callback, frozenset(events or LivePoller.EVENTS)))
+
+    def unsubscribe(self, callback):
+        self.__subscribers = [(c, e) for c, e in self.__subscribers if c != callback]
+
+    def poll(self):
+        """
+        Polls all registered variants once.
+        """
+        with self.__lock:
+            ids = self.__ids.tolist()
+
+        for i, part in enumerate(chunks(ids, self.batch)):
+            if i > 0 and self.rate:
+                if self.__stop.wait(1.0 / self.rate):
+                    return
+
+            self.update(part, self.api.live_variant(part))
+
+    def update(self, ids, response):
+        """
+        Takes over a response of :py:func:`aboutyou.api.Api.live_variant`.
+        A variant missing in the response is out of stock.
+
+        :param list ids: The requested variant ids.
+        :param dict response: The live data by variant id.
+        """
+        events = []
+
+        with self.__lock:
+            for vid in ids:
+                slot = self.__slots.get(vid)
+
+                if slot is None:
+                    continue
+
+                live = response.get(str(vid)) or response.get(vid) or {}
+                stock = live.get('available_stock', 0)
+                price = live.get('price', self.__price[slot])
+
+                old_stock = self.__stock[slot]
+                old_price = self.__price[slot]
+
+                self.__stock[slot] = stock
+                self.__price[slot] = price
+
+                if old_stock > 0 and stock <= 0:
+                    events.append((LivePoller.STOCK_OUT, vid, old_stock, stock))
+                elif old_stock == 0 and stock > 0:
+                    events.append((LivePoller.BACK_IN_STOCK, vid, old_stock, stock))
+
+                if old_price != UNKNOWN and price < old_price:
+                    events.append((LivePoller.PRICE_DROP, vid, old_price, price))
+                elif old_price != UNKNOWN and price > old_price:
+                    events.append((LivePoller.PRICE_RISE, vid, old_price, price))
+
+        for event in events:
+            self.__emit(*event)
+
+    def __emit(self, event, vid, old, new):
+        for callback, events in self.__subscribers:
+            if event in events:
+                try:
+                    callback(event, vid, old, new)
+                except Exception:
+                    self.log.exception('')
+
+    def start(self):
+        """
+        Starts polling in a background thread.
+        """
+        if self.__thread is not None:
+            return
+
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, name="aboutyou-live")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread.
+        """
+        self.__stop.set()
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self):
+        while not self.__stop.is_set():
+            started = time.time()
+
+            try:
+                if len(self.__ids) > 0:
+                    self.poll()
+            except Exception:
+                self.log.exception('')
+
+            self.__stop.wait(max(0, self.interval - (time.time() - started)))
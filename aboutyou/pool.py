@@ -0,0 +1,222 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+A small HTTP/1.1 keep-alive connection pool.
+
+Every endpoint (scheme, host, port) gets its own set of idle connections,
+which are reused for the following requests instead of doing a new TCP
+and TLS handshake each time.
+"""
+import io
+import logging
+import socket
+import sys
+import threading
+import time
+
+if sys.version[0] == '2':
+    import httplib
+    import urlparse
+    from urllib import getproxies, proxy_bypass
+    from urllib2 import HTTPError
+else:
+    import http.client as httplib
+    import urllib.parse as urlparse
+    from urllib.error import HTTPError
+    from urllib.request import getproxies, proxy_bypass
+
+
+def pool_options(config):
+    """
+    Reads the pool options of a configuration.
+
+    :param config: A :py:class:`aboutyou.config.Config` instance.
+    :returns: The keyword arguments for a pool or None,
+              if the pool is disabled.
+    """
+    from .config import Config
+
+    pool = config.pool
+
+    if pool is False:
+        return None
+
+    options = dict(Config.PARAMS["pool"])
+
+    if pool is not None:
+        options.update(pool)
+
+    return options
+
+
+def proxy_for(url):
+    """
+    :param str url: The url to request.
+    :returns: The proxy url of the *http_proxy* or *https_proxy* environment
+              variables for the url or None, if it is requested directly.
+    """
+    parts = urlparse.urlsplit(url)
+    proxy = getproxies().get(parts.scheme or 'http')
+
+    if proxy and not proxy_bypass(parts.hostname or ''):
+        return proxy
+
+    return None
+
+
+class PoolException(HTTPError):
+    """
+    A HTTP error response. It is a :py:class:`urllib.error.HTTPError`,
+    like the errors of *urlopen*, with the status code as *code*.
+    """
+    def __init__(self, url, status, reason, headers=None, body=b''):
+        HTTPError.__init__(self, url, status, reason, headers, io.BytesIO(body))
+
+    @property
+    def status(self):
+        return self.code
+
+
+class ConnectionPool(object):
+    """
+    Keeps alive HTTP connections per endpoint.
+
+    :param int maxsize: The maximum of idle connections kept per endpoint.
+    :param int idle: Seconds after which an idle connection is closed.
+    :param int timeout: The socket timeout in seconds.
+
+    .. code-block:: python
+
+        >>> pool = ConnectionPool(maxsize=4)
+        >>> pool.request('https://shop-api.aboutyou.de/api', body, headers)
+    """
+    def __init__(self, maxsize=10, idle=60, timeout=30):
+        self.maxsize = maxsize
+        self.idle = idle
+        self.timeout = timeout
+
+        self.__lock = threading.Lock()
+        self.__connections = {}
+
+        self.log = logging.getLogger("aboutyou.pool")
+
+    def __key(self, url):
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme or 'http'
+        port = parts.port or (443 if scheme == 'https' else 80)
+
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        return (scheme, parts.hostname, port), path
+
+    def __connect(self, key):
+        scheme, host, port = key
+
+        self.log.debug('connect %s://%s:%s', scheme, host, port)
+
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+    def __acquire(self, key):
+        now = time.time()
+
+        with self.__lock:
+            idle = self.__connections.get(key, [])
+            fresh = []
+
+            for conn, last in idle:
+                if now - last > self.idle:
+                    conn.close()
+                else:
+                    fresh.append((conn, last))
+
+            if fresh:
+                conn, last = fresh.pop()
+                self.__connections[key] = fresh
+                return conn, True
+
+            self.__connections[key] = fresh
+
+        return self.__connect(key), False
+
+    def __release(self, key, conn):
+        with self.__lock:
+            idle = self.__connections.setdefault(key, [])
+
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+
+        conn.close()
+
+    def request(self, url, body, headers, retry=True):
+        """
+        POSTs the body to the url and returns the raw response body.
+
+        A reused connection which was closed by the server in the meantime
+        is replaced once by a new one, if *retry* is set. The request is only
+        send again, if the server closed the connection without answering,
+        never after a timeout.
+
+        :param str url: The url to post to.
+        :param bytes body: The request body.
+        :param dict headers: The request headers.
+        :param bool retry: False for requests, which must not be send twice.
+        :returns: The response body as bytes.
+        :raises PoolException: If the server answers with an error status.
+        """
+        key, path = self.__key(url)
+
+        while True:
+            conn, reused = self.__acquire(key)
+
+            try:
+                conn.request("POST", path, body, headers)
+                response = conn.getresponse()
+            except socket.timeout:
+                conn.close()
+                raise
+            except (httplib.BadStatusLine, socket.error):
+                # the connection was closed before any byte of a response
+                conn.close()
+
+                if reused and retry:
+                    self.log.debug('stale connection to %s:%s', key[1], key[2])
+                    continue
+
+                raise
+            except:
+                conn.close()
+                raise
+
+            try:
+                data = response.read()
+            except:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.__release(key, conn)
+
+            if response.status >= 400:
+                raise PoolException(url, response.status, response.reason, response.msg, data)
+
+            return data
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        with self.__lock:
+            for idle in self.__connections.values():
+                for conn, last in idle:
+                    conn.close()
+
+            self.__connections = {}
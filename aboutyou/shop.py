@@ -6,17 +6,43 @@ ShopApi is the attempt to make Api a little bit more userfriendly
 and hides much of the direct calls to the Collins Api.
 """
 from .api import Api, ApiException
+from .cache import ClientPool, Codec, LocalCache, TieredCache, WriteBehind
 from .config import Config
-from .constants import PRODUCT_FIELD, TYPE
+from .constants import FACET, PRODUCT_FIELD, TYPE
+from .live import LivePoller
+from .snapshot import Snapshot, SnapshotException, write_snapshot
+from .store import MemcachedStore, MemoryStore, SQLiteStore, StoreConflict
 
-import bz2
+import bisect
+import hashlib
 import json
+import sys
 import logging
+import threading
 import uuid
 
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+PAGE_SIZE = 200
+"""The maximum of products in one search request."""
+
+WINDOW_GAP = 10
+"""
+The most products in a gap between two asked positions, which are fetched
+to save a request. Slices with a wider step fetch only the asked products.
+"""
+
+if sys.version[0] == '2':
+    string_types = basestring
+else:
+    string_types = str
+
 
 class Node(object):
     """A simple wrapper around a dict object."""
+    __slots__ = ('shop', 'obj')
 
     def __init__(self, shop, obj):
         self.shop = shop
@@ -70,11 +96,30 @@ class Category(Node):
         2      Gürtel
         2      Handschuhe
     """
+    __slots__ = ('sub_categories',)
+
     def __init__(self, shop, obj):
         super(Category, self).__init__(shop, obj)
 
         self.sub_categories = []
 
+    @property
+    def parent(self):
+        """
+        The parent :py:class:`aboutyou.shop.Category` or None for a root.
+        """
+        ancestors = self.shop._category_position(self.id)[0]
+
+        if ancestors:
+            return self.shop.category_by_id(ancestors[-1])
+
+    @property
+    def depth(self):
+        """
+        The level of the category in the tree, 0 for a root.
+        """
+        return len(self.shop._category_position(self.id)[0])
+
     def treeiter(self):
         """
         Walks the whole tree beginning from this node.
@@ -103,6 +148,56 @@ class Category(Node):
         return self.name
 
 
+def normalize_name(text):
+    """
+    The form of facet names and values in a
+    :py:class:`aboutyou.shop.FacetIndex`.
+    """
+    return u' '.join(text.split()).lower()
+
+
+class FacetIndex(object):
+    """
+    A sorted index of the normalized names and values of facets.
+
+    :param entries: Tuples (name or value, item) of the facets.
+    """
+    __slots__ = ('keys', 'items')
+
+    def __init__(self, entries):
+        entries = sorted((normalize_name(key), item) for key, item in entries
+                         if isinstance(key, string_types) and key.strip())
+
+        self.keys = [key for key, item in entries]
+        self.items = [item for key, item in entries]
+
+    def find(self, text, prefix=False):
+        """
+        :param str text: The name or value, the case does not matter.
+        :param bool prefix: If True, find the ones beginning with *text*.
+        :returns: A list of the items, without duplicates.
+        """
+        text = normalize_name(text)
+        pos = bisect.bisect_left(self.keys, text)
+        found = []
+        seen = set()
+
+        while pos < len(self.keys):
+            key = self.keys[pos]
+
+            if key != text and not (prefix and key.startswith(text)):
+                break
+
+            # the name and the value of a facet share the same item
+            if id(self.items[pos]) not in seen:
+                seen.add(id(self.items[pos]))
+                found.append(self.items[pos])
+
+            pos += 1
+
+        return found
+
+
 class FacetGroup(object):
     """
     A container which holds a group of facets.
@@ -124,10 +219,37 @@ class FacetGroup(object):
         4 95 C
 
     """
+    __slots__ = ('id', 'name', 'facets', '_index')
+
     def __init__(self, fid, name, facets):
         self.id = fid
         self.name = name
         self.facets = facets
+        self._index = None
+
+    def find(self, text, prefix=False):
+        """
+        Finds facets by their name or value, the case does not matter.
+
+        :param str text: The name or value, for example from an url.
+        :param bool prefix: If True, find the facets beginning with *text*.
+        :returns: A list of :py:class:`aboutyou.shop.Node`.
+
+        .. code-block:: python
+
+            >>> [f.facet_id for f in shop.facet_group_by_id('color').find('Rot')]
+            [12]
+        """
+        if self._index is None:
+            entries = []
+
+            for facet in self.facets.values():
+                entries.append((facet.obj.get('name'), facet))
+                entries.append((facet.obj.get('value'), facet))
+
+            self._index = FacetIndex(entries)
+
+        return self._index.find(text, prefix)
 
     def __getitem__(self, idx):
         return self.facets[idx]
@@ -150,6 +272,8 @@ class Image(Node):
     """
     Represents an image.
     """
+    __slots__ = ()
+
     def __init__(self, shop, obj):
         super(Image, self).__init__(shop, obj)
 
@@ -179,29 +303,22 @@ class Image(Node):
 
 
 class VariantAttributes(object):
+    """
+    The facets of a variant by the name and the id of their group.
+
+    Variants with the same attributes share one instance, see
+    :py:func:`aboutyou.shop.ShopApi.variant_attributes`.
+    """
+    __slots__ = ('obj', 'shop', '__data')
+
     def __init__(self, shop, obj):
         self.obj = obj
         self.shop = shop
 
-        prefixlen = len("attributes_")
         self.__data = {}
 
         for name, value in obj.items():
-            grpid = int(name[prefixlen:])
-            facets = shop.facet_group_by_id(grpid)
-
-            collection = []
-            for f in value:
-                g = facets.facets.get(f, None)
-
-                if g is None:
-                    g = Node(shop, {'id': facets.id,
-                                        'name': 'unknown_{}'.format(f),
-                                        'value': 'unknown_{}'.format(f),
-                                        'facet_id': f})
-                    facets.facets[f] = g
-
-                collection.append(g)
+            facets, collection = shop._attribute_facets(name, value)
 
             self.__data[facets.name] = collection
             self.__data[facets.id] = collection
@@ -213,19 +330,21 @@ class VariantAttributes(object):
         if idx in self.__data:
             return self.__data[idx]
         else:
-            return []
+            return ()
 
 
 class Variant(Node):
     """
     A variant of a Product.
     """
+    __slots__ = ('_hash', '_images', '_attributes')
+
     def __init__(self, shop, obj):
         super(Variant, self).__init__(shop, obj)
 
         self._hash = obj['id']
         self._images = [Image(shop, i) for i in obj["images"]]
-        self._attributes = VariantAttributes(shop, obj["attributes"])
+        self._attributes = None
 
     @property
     def images(self):
@@ -239,13 +358,37 @@ class Variant(Node):
         """
         The attributes aka facets of this product variant.
         """
+        if self._attributes is None:
+            self._attributes = self.shop.variant_attributes(self.obj["attributes"])
+
         return self._attributes
 
     def live(self):
         """
         The live data to this variant.
+
+        With the *live* option of the config the variant is polled in the
+        background and the last polled stock and price are returned.
+
+        :returns: A dict with *available_stock* and *price* or None,
+                  if the Api does not know the variant.
         """
-        return self.shop.api.livevariant([self.id])
+        poller = self.shop.live
+
+        if poller is not None:
+            poller.register([self.id])
+            stock = poller.stock(self.id)
+
+            if stock is not None:
+                return {"id": self.id, "available_stock": stock,
+                        "price": poller.price(self.id)}
+
+        response = self.shop.api.live_variant([self.id])
+
+        if poller is not None:
+            poller.update([self.id], response)
+
+        return response.get(str(self.id))
 
     def costumize(self):
         """
@@ -258,6 +401,14 @@ class Variant(Node):
     def __hash__(self):
         return self._hash
 
+    def __eq__(self, other):
+        # instances of the same variant are equal, a costumized variant
+        # is only equal to itself, because its hash is random
+        return type(self) is type(other) and self._hash == other._hash
+
+    def __ne__(self, other):
+        return not self == other
+
 
 class CostumizedVariant(Variant):
     """
@@ -269,6 +420,8 @@ class CostumizedVariant(Variant):
         >>> costum.additional_data['description'] = 'my very own variant'
         >>> costum.additional_data['logo'] = 'A little froggy'
     """
+    __slots__ = ('additional_data',)
+
     def __init__(self, variant):
         # super(type(self), self).__init__(variant.shop, variant.obj)
         self.obj = variant.obj
@@ -297,14 +450,21 @@ class Product(Node):
         If enabled in the configuration, when accessing a field which data
         is not present, for example the variants, then the variants will be
         automaticly requested.
+
+        If *sibling_fetch* is enabled in the configuration, a missing field
+        of a product from a search result is fetched for all products of
+        its page in one request.
     """
+    __slots__ = ('_siblings', '__variants', '__categories', '__default_image',
+                 '__default_variant', '__styles')
+
     def __init__(self, shop, obj):
         super(Product, self).__init__(shop, obj)
 
+        self._siblings = None
+
         self.__variants = None
         self.__categories = None
-        self.__short_description = None
-        self.__long_description = None
         self.__default_image = None
         self.__default_variant = None
         self.__styles = None
@@ -316,8 +476,15 @@ class Product(Node):
         slug = self.name.strip().replace(" ", "-") + "-" + str(self.id)
         return self.shop.api.config.product_url.format(slug)
 
-    def __update_cache(self):
-        self.shop.cache_set(str(self.obj['id']), self.obj)
+    def __fetch(self, fields):
+        """
+        Fetches the fields for this product, or for all products of its
+        search result page if sibling fetching is enabled.
+        """
+        if self._siblings is not None and self.shop.config.sibling_fetch:
+            self.shop.prefetch(self._siblings, fields)
+        else:
+            self.shop.prefetch([self], fields)
 
     @property
     def categories(self):
@@ -329,10 +496,7 @@ class Product(Node):
 
             if catname not in self.obj and self.shop.config.auto_fetch:
                 self.shop.log.debug('update categories from product %s', self.obj['id'])
-                data = self.shop.api.products(ids=[self.id], fields=[PRODUCT_FIELD.CATEGORIES])
-                self.obj.update(data["ids"][str(self.id)])
-
-                self.__update_cache()
+                self.__fetch([PRODUCT_FIELD.CATEGORIES])
 
             self.__categories = [[self.shop.category_by_id(cid) for cid in path] for path in self.obj[catname]]
 
@@ -347,12 +511,7 @@ class Product(Node):
 
             if "variants" not in self.obj and self.shop.config.auto_fetch:
                 self.shop.log.debug('update variants from product %s', self.obj['id'])
-                data = self.shop.api.products(ids=[self.id],
-                                                   fields=[PRODUCT_FIELD.VARIANTS])
-                self.obj.update(data["ids"][str(self.id)])
-
-                self.__update_cache()
-
+                self.__fetch([PRODUCT_FIELD.VARIANTS])
 
             self.__variants = [Variant(self.shop, v) for v in self.obj["variants"]]
 
@@ -367,10 +526,7 @@ class Product(Node):
         if self.__default_image is None:
             if "default_image" not in self.obj and self.shop.config.auto_fetch:
                 self.shop.log.debug('update default_image from product %s', self.obj['id'])
-                data = self.shop.api.products(ids=[self.obj['id']], fields=[PRODUCT_FIELD.DEFAULT_IMAGE])
-                self.obj.update(data["ids"][str(self.id)])
-
-                self.__update_cache()
+                self.__fetch([PRODUCT_FIELD.DEFAULT_IMAGE])
 
             self.__default_image = Image(self.shop, self.obj["default_image"])
 
@@ -386,10 +542,7 @@ class Product(Node):
         if self.__default_variant is None:
             if "default_variant" not in self.obj and self.shop.config.auto_fetch:
                 self.shop.log.debug('update default_variant from product %s', self.obj['id'])
-                data = self.shop.api.products(ids=[self.obj['id']], fields=[PRODUCT_FIELD.DEFAULT_VARIANT])
-                self.obj.update(data["ids"][str(self.obj['id'])])
-
-                self.__update_cache()
+                self.__fetch([PRODUCT_FIELD.DEFAULT_VARIANT])
 
             self.__default_variant = Variant(self.shop, self.obj["default_variant"])
 
@@ -404,26 +557,24 @@ class Product(Node):
         """
         if self.__styles is None:
             if "styles" not in self.obj and self.shop.config.auto_fetch:
-                data = self.shop.log.debug('update styles from product %s', self.obj['id'])
-
-                self.obj.update(data["ids"][str(self.obj['id'])])
-
-                self.__update_cache()
+                self.shop.log.debug('update styles from product %s', self.obj['id'])
+                self.__fetch([PRODUCT_FIELD.STYLES])
 
+            cached = self.shop.cache_get_many([str(pobj['id']) for pobj in self.obj['styles']])
             styles = []
 
             for pobj in self.obj['styles']:
-                tmp = self.shop.cache_get(str(pobj['id']))
+                tmp = cached.get(str(pobj['id']))
 
                 if tmp is None:
                     tmp = pobj
                 else:
                     tmp.update(pobj)
 
-                self.shop.cache_set(str(tmp['id']), tmp)
-
                 styles.append(Product(self.shop, tmp))
 
+            self.shop.cache_set_many(dict((str(p.obj['id']), p.obj) for p in styles))
+
             self.__styles = styles
 
         return self.__styles
@@ -431,13 +582,9 @@ class Product(Node):
     def __getattr__(self, name):
         if not name.startswith('__') and name not in self.obj and self.shop.config.auto_fetch:
             self.shop.log.debug('update %s from product %s', name, self.obj['id'])
-            data = self.shop.api.products(ids=[self.obj['id']],
-                                               fields=[PRODUCT_FIELD.DESCRIPTION_SHORT,
-                                                       PRODUCT_FIELD.DESCRIPTION_LONG,
-                                                       PRODUCT_FIELD.SALE])
-            self.obj.update(data["ids"][str(self.obj['id'])])
-
-            self.__update_cache()
+            self.__fetch([PRODUCT_FIELD.DESCRIPTION_SHORT,
+                          PRODUCT_FIELD.DESCRIPTION_LONG,
+                          PRODUCT_FIELD.SALE])
 
         return self.obj[name]
 
@@ -446,49 +593,111 @@ class Product(Node):
 
 
 class ResultProducts(object):
+    """
+    The products of a :py:class:`aboutyou.shop.Search`, which are fetched
+    on demand. Indexing and slicing only request the positions, which were
+    not fetched before by this instance, and negative indices count from
+    the end of the result.
+
+    .. code-block:: python
+
+        >>> search.products[9800:9824]
+        >>> search.products[-1]
+    """
     def __init__(self, search):
         self.search = search
+        self.__fetched = {}
 
     def __getitem__(self, idx):
         if isinstance(idx, slice):
-            start = idx.start
-            if start is None:
-                start = 0
+            positions = range(*idx.indices(self.search.count))
+            self.__fetch(positions)
 
-            stop = idx.stop
-            stop = min(stop, self.search.count)
+            # positions behind a shrunken count are left out
+            return [self.__fetched[i] for i in positions if i in self.__fetched]
+        else:
+            if idx < 0:
+                idx += self.search.count
 
-            step = idx.step
-            if step is None:
-                step = 1
+            if not 0 <= idx < self.search.count:
+                raise IndexError("product index out of range")
 
-            buff = []
+            self.__fetch([idx])
 
-            if stop < 200:
-                offset = 0
-                count = stop
-                buff = self.gather(0, stop)
-            else:
-                offset = 200 * int(start / 200)  # get clean step offset
-                pos = offset
-                count = (stop-offset)
+            if idx not in self.__fetched:
+                raise IndexError("product index out of range")
+
+            return self.__fetched[idx]
 
-                for i in xrange(count / 200):
-                    buff += self.gather(pos, 200)
-                    pos += 200
+    def __fetch(self, positions):
+        windows = self.__windows([i for i in positions if i not in self.__fetched])
 
-                if count % 200 != 0:
-                    buff += self.gather(pos, 200)
+        if len(windows) == 0:
+            return
 
-            return [buff[i] for i in xrange(start-offset, count, step)]
+        if len(windows) == 1:
+            responses = [self.__request(*windows[0])]
         else:
-            return self.gather(idx, 1)[0]
+            responses = self.search.shop.api._fanout(lambda window: self.__request(*window), windows, list)
+
+        # the products are built in this thread,
+        # because the cache client may not be thread safe.
+        for (offset, limit), response in zip(windows, responses):
+            for i, product in enumerate(self._products(response)):
+                self.__fetched[offset + i] = product
+
+    @staticmethod
+    def __windows(positions):
+        """
+        Groups the positions into the (offset, limit) windows to request.
+        A window ends at a gap of more than *WINDOW_GAP* products, so a wide
+        step fetches no product which was not asked, or when it reaches
+        the page size.
+        """
+        windows = []
+
+        for pos in sorted(positions):
+            if windows:
+                offset, limit = windows[-1]
+
+                if pos - (offset + limit) <= WINDOW_GAP and pos - offset < PAGE_SIZE:
+                    windows[-1] = (offset, pos - offset + 1)
+                    continue
+
+            windows.append((pos, 1))
+
+        return windows
 
     def __len__(self):
         return self.search.count
 
     def __iter__(self):
-        step = 200
+        return self.iter()
+
+    def iter(self, readahead=None):
+        """
+        Iterates over all products of the search.
+
+        :param int readahead: The count of pages of 200 products, which are
+                              requested in parallel ahead of the consumer.
+                              Default is the *readahead* of the config,
+                              0 fetches one page after another.
+
+        .. code-block:: python
+
+            >>> for product in search.products.iter(readahead=4):
+            ...     export(product)
+        """
+        if readahead is None:
+            readahead = self.search.shop.config.readahead or 0
+
+        if readahead > 0:
+            return self.__readahead(readahead)
+
+        return self.__sequential()
+
+    def __sequential(self):
+        step = PAGE_SIZE
         pos = 0
         # 'for' will not work, because 'count' can change each gather call.
         # for i in xrange(0, self.search.count):
@@ -500,30 +709,84 @@ class ResultProducts(object):
 
             pos += step
 
+    def __readahead(self, pages):
+        step = PAGE_SIZE
+        pos = 0
+        pending = deque()
+        workers = ThreadPool(pages)
+
+        try:
+            # the count is checked again after each page,
+            # pages behind a shrinking count just come back empty.
+            while pending or pos < self.search.count:
+                while len(pending) < pages and pos < self.search.count:
+                    pending.append(workers.apply_async(self.__request, (pos, step)))
+                    pos += step
+
+                # the products are built in this thread,
+                # because the cache client may not be thread safe.
+                for item in self._products(pending.popleft().get()):
+                    yield item
+        finally:
+            workers.terminate()
+
     def gather(self, offset, limit):
-        self.search.result['offset'] = offset
-        self.search.result['limit'] = limit
+        """
+        Fetches *limit* products beginning at *offset*.
+
+        :returns: A list of :py:class:`aboutyou.shop.Product`.
+        """
+        return self._products(self.__request(offset, limit))
 
-        self.search.shop.log.debug('gather %s %s %s', self.search.sessionid, self.search.filter, self.search.result)
+    def __request(self, offset, limit):
+        result = dict(self.search.result, offset=offset, limit=limit)
 
-        response = self.search.shop.api.product_search(self.search.sessionid, filter=self.search.filter, result=self.search.result)
+        self.search.shop.log.debug('gather %s %s %s', self.search.sessionid, self.search.filter, result)
 
+        return self.search.shop._product_search(self.search.sessionid, self.search.filter, result)
+
+    def _products(self, response):
         # the result count can change ANY request !!!
         self.search.count = response['product_count']
 
         self.search.shop.log.debug('result count %s : %s', len(response['products']), response['product_count'])
 
+        shop = self.search.shop
+
+        if not shop.cache_search:
+            return self.__siblings([Product(shop, p) for p in response["products"]])
+
+        cached = shop.cache_get_many([str(p["id"]) for p in response["products"]])
+
         buff = []
+        changed = {}
         for p in response["products"]:
-            pobj = self.search.shop.cache_get(str(p["id"]))
+            sid = str(p["id"])
+            pobj = cached.get(sid)
 
             if pobj:
-                pobj.update(p)
+                # only write back, if the search result knows something new
+                if any(pobj.get(key) != value for key, value in p.items()):
+                    pobj.update(p)
+                    changed[sid] = pobj
             else:
                 pobj = p
+                changed[sid] = pobj
+
+            buff.append(Product(shop, pobj))
+
+        if shop.write_behind is not None:
+            shop.write_behind.put(changed)
+        else:
+            shop.cache_set_many(changed)
 
-            self.search.shop.cache_set(str(pobj['id']), pobj)
-            buff.append(Product(self.search.shop, pobj))
+        return self.__siblings(buff)
+
+    def __siblings(self, buff):
+        # the page is only kept alive by its products, if it is used
+        if self.search.shop.config.sibling_fetch:
+            for product in buff:
+                product._siblings = buff
 
         return buff
 
@@ -531,8 +794,10 @@ class ResultProducts(object):
 class Search(object):
     """
     Representing an initiated search.
+
+    :param obj: The response of the initial search, if it was already requested.
     """
-    def __init__(self, shop, sessionid, filter=None, result=None):
+    def __init__(self, shop, sessionid, filter=None, result=None, obj=None):
         self.shop = shop
         self.sessionid = sessionid
         self.filter = filter
@@ -545,7 +810,10 @@ class Search(object):
             self.result["limit"] = 0
             self.result["offset"] = 0
 
-        self.obj = self.shop.api.product_search(self.sessionid, filter=self.filter, result=self.result)
+        if obj is None:
+            obj = self.shop._product_search(self.sessionid, self.filter, self.result)
+
+        self.obj = obj
 
         self.count = self.obj["product_count"]
 
@@ -565,6 +833,94 @@ class BasketException(Exception):
         self.withError = withError
 
 
+class ItemRange(object):
+    """
+    The ids of the basket items of one variant.
+
+    The ids are a prefix and a counter, so any count of items is stored
+    as the two ends of a range instead of a list of ids.
+    Ids which do not fit into the range, like the ones of items added by
+    an other process, are kept as a tuple in *extra*.
+
+    .. code-block:: python
+
+        >>> items = ItemRange('3f2a9c0d-1', 4, 7)
+        >>> len(items)
+        3
+        >>> list(items)
+        ['3f2a9c0d-1-4', '3f2a9c0d-1-5', '3f2a9c0d-1-6']
+    """
+    __slots__ = ('prefix', 'start', 'stop', 'extra')
+
+    def __init__(self, prefix, start=0, stop=0, extra=()):
+        self.prefix = prefix
+        self.start = start
+        self.stop = stop
+        self.extra = extra
+
+    @classmethod
+    def from_ids(cls, ids):
+        """
+        Builds the range of a list of ids, the longest run of one prefix
+        is the range and all other ids are *extra*.
+
+        :param list ids: The ids of the basket items.
+        """
+        numbers = {}
+
+        for i in ids:
+            prefix, sep, number = i.rpartition('-')
+
+            if prefix and number.isdigit():
+                numbers.setdefault(prefix, set()).add(int(number))
+
+        if not numbers:
+            return cls('', 0, 0, tuple(ids))
+
+        prefix = max(numbers, key=lambda p: len(numbers[p]))
+        start = min(numbers[prefix])
+        stop = start
+
+        while stop in numbers[prefix]:
+            stop += 1
+
+        items = cls(prefix, start, stop)
+        inside = set(items.ids(start, stop))
+        items.extra = tuple(i for i in ids if i not in inside)
+
+        return items
+
+    def __len__(self):
+        return self.stop - self.start + len(self.extra)
+
+    def __iter__(self):
+        return iter(list(self.extra) + self.ids(self.start, self.stop))
+
+    def ids(self, start, stop):
+        """
+        :returns: The list of the ids from *start* to *stop*.
+        """
+        return ['{}-{}'.format(self.prefix, i) for i in range(start, stop)]
+
+    def resized(self, count):
+        """
+        :param int count: The new count of items.
+        :returns: A tuple of the new :py:class:`aboutyou.shop.ItemRange`,
+                  the ids to add and the ids to remove.
+                  Items are added at the end and removed at the front,
+                  the *extra* ids first.
+        """
+        delta = count - len(self)
+
+        if delta >= 0:
+            items = ItemRange(self.prefix, self.start, self.stop + delta, self.extra)
+            return items, self.ids(self.stop, items.stop), []
+        else:
+            drop = min(-delta, len(self.extra))
+            items = ItemRange(self.prefix, self.start - delta - drop, self.stop, self.extra[drop:])
+            return items, [], list(self.extra[:drop]) + self.ids(self.start, items.start)
+
+
 class Basket(object):
     """
     An object which wrappes the shop basket for a session id.
@@ -576,9 +932,25 @@ class Basket(object):
 
         >>> basket = shop.basket('s3ss10n')
 
+    The Api needs one order line per item. The ids of the items of a
+    variant are kept as an :py:class:`aboutyou.shop.ItemRange`
+    in *basket_ids_by_variant*. Every basket instance counts its own
+    ranges, so two processes changing the same basket never use
+    the same id.
+
+    With the *basket_pricing* option of the config, :py:func:`update`
+    does not wait for the Api. The totals are calculated right away by
+    :py:func:`local_totals` and the changes are send in the background.
+    If the totals of the Api differ, *on_mismatch* is called with the
+    basket, the local and the Api totals.
+    If a change fails, it and the changes made after it are taken back,
+    the error is raised by :py:func:`wait`.
+
     :param shop: The ShopApi instance.
     :param sessionid: The session id the basket is associated with.
     """
+    TOTALS = ('total_price', 'total_net', 'total_vat')
+
     def __init__(self, shop, sessionid):
         self.shop = shop
         self.sessionid = sessionid
@@ -587,9 +959,163 @@ class Basket(object):
         self.variants = {}
         self.basket_ids_by_variant = {}
 
+        self.__prefix = uuid.uuid4().hex[:16]
+        self.__ranges = 0
+
+        # the version of the state in the basket store
+        self.version = 0
+
+        # the optimistic totals, until the Api answered
+        self._totals = None
+        self.on_mismatch = shop.on_basket_mismatch
+        self.error = None
+
+        # guards the queue and the state, which the background requests
+        # of optimistic baskets change, the dicts are only replaced
+        # and never changed in place, so readers can iterate them
+        self.__lock = threading.RLock()
+        self.__queue = deque()
+        self.__running = False
+        self.__idle = threading.Event()
+        self.__idle.set()
+
     def __getattr__(self, name):
+        if name in Basket.TOTALS and self._totals is not None:
+            return self._totals[name]
+
         return self.obj[name]
 
+    def _state(self):
+        """
+        :returns: The state of the basket for the basket store.
+        """
+        items = []
+
+        with self.__lock:
+            basket_ids_by_variant = self.basket_ids_by_variant
+            obj = self.obj
+
+        for variant, ids in basket_ids_by_variant.items():
+            item = {'variant_id': variant.id, 'prefix': ids.prefix,
+                    'start': ids.start, 'stop': ids.stop}
+
+            if ids.extra:
+                item['extra'] = list(ids.extra)
+
+            if isinstance(variant, CostumizedVariant):
+                item['hash'] = variant._hash
+                item['additional_data'] = variant.additional_data
+
+            items.append(item)
+
+        return {'items': items, 'obj': obj}
+
+    def _restore(self, state, version):
+        """
+        Takes over a state from the basket store.
+        """
+        variants = {}
+        basket_ids_by_variant = {}
+        obj = None
+
+        if state is not None:
+            # the prefix of the ranges is not taken over,
+            # new ranges of this instance get its own one
+            obj = state['obj']
+            known = self.__known_variants(obj)
+
+            for item in state['items']:
+                variant = self.__variant(item['variant_id'], known)
+
+                if 'hash' in item:
+                    variant = CostumizedVariant(variant)
+                    variant._hash = item['hash']
+                    variant.additional_data = item['additional_data']
+
+                ids = ItemRange(item['prefix'], item['start'], item['stop'], tuple(item.get('extra', ())))
+                basket_ids_by_variant[variant] = ids
+                variants[variant] = len(ids)
+
+        with self.__lock:
+            self.version = version
+            self.obj = obj
+            self.variants = variants
+            self.basket_ids_by_variant = basket_ids_by_variant
+
+    def __known_variants(self, obj):
+        # the variants are rebuild from the products of the basket response
+        known = {}
+        for product in ((obj or {}).get('products') or {}).values():
+            for vobj in product.get('variants', []):
+                known[vobj['id']] = vobj
+
+        return known
+
+    def __variant(self, vid, known):
+        return Variant(self.shop, known.get(vid, {'id': vid, 'images': [], 'attributes': {}}))
+
+    def _rebuild(self):
+        """
+        Takes over the items of the last basket response, if it does not
+        fit to the local state any more. The items of lines with an error
+        are left out.
+        """
+        with self.__lock:
+            self.__rebuild()
+
+    def __rebuild(self):
+        owners = {}
+        for variant, ids in self.basket_ids_by_variant.items():
+            for i in ids:
+                owners[i] = variant
+
+        known = self.__known_variants(self.obj)
+        costumized = {}
+        lines = {}
+
+        for line in (self.obj or {}).get('order_lines', []):
+            if 'variant_id' not in line or 'error_message' in line:
+                continue
+
+            variant = owners.get(line['id'])
+
+            if variant is None and line.get('additional_data'):
+                key = (line['variant_id'], json.dumps(line['additional_data'], sort_keys=True))
+
+                if key not in costumized:
+                    costumized[key] = CostumizedVariant(self.__variant(line['variant_id'], known))
+                    costumized[key].additional_data = line['additional_data']
+
+                variant = costumized[key]
+            elif variant is None:
+                variant = self.__variant(line['variant_id'], known)
+
+            lines.setdefault(variant, []).append(line['id'])
+
+        self.variants = dict((variant, len(ids)) for variant, ids in lines.items())
+        self.basket_ids_by_variant = dict((variant, ItemRange.from_ids(ids)) for variant, ids in lines.items())
+
+    def _sync(self):
+        """
+        Takes over the state of the basket store, if it was changed
+        by an other process.
+        """
+        store = self.shop.basket_store
+
+        if store is None:
+            return
+
+        with self.__lock:
+            if self.__running:
+                # the own changes are still send, they are saved afterwards
+                return
+
+            state, version = store.get(self.sessionid)
+
+            if version != self.version:
+                self.shop.log.debug('resume basket %s version %s', self.sessionid, version)
+                self._restore(state, version)
+
     def _check_obj(self):
         withError = []
         fine = []
@@ -614,49 +1140,279 @@ class Basket(object):
         :param int count: The amount of the items. If set to 0 the item is removed.
         :raises BasketException: If there is an error in the basket.
         """
-        def push_ids(ids):
-            vid = variant.id
+        self.update({variant: count})
+
+    def update(self, counts):
+        """
+        Sets the counts of several variants with one request.
+
+        :param dict counts: The amount of the items by their
+                            :py:class:`aboutyou.shop.Variant` or
+                            :py:class:`aboutyou.shop.CostumizedVariant`.
+                            A count of 0 removes the item.
+        :raises BasketException: If there is an error in the basket.
+
+        .. code-block:: python
+
+            >>> basket.update({variant: 2, other_variant: 0})
+        """
+        self._sync()
+
+        with self.__lock:
+            add, remove, changed = self.__changes(counts)
+
+            if len(changed) == 0:
+                return
+
+            if self.shop.config.basket_pricing:
+                previous = dict((variant, self.basket_ids_by_variant.get(variant)) for variant in changed)
+
+                self.__apply(changed)
+                self._totals = self.local_totals()
+                self.__submit((add, remove, self._totals, previous))
+                return
+
+        obj = self.shop.api.basket_update(self.sessionid, add=add, remove=remove)
+
+        with self.__lock:
+            self.obj = obj
+            self.__apply(changed)
+
+        try:
+            self._check_obj()
+        except BasketException:
+            # the response tells, which items the Api took
+            self._rebuild()
+            raise
+        finally:
+            self.__save()
+
+    def __changes(self, counts):
+        """
+        :returns: The ids to add, the ids to remove and the new
+                  :py:class:`aboutyou.shop.ItemRange` of the changed variants.
+        """
+        add = []
+        remove = []
+        changed = {}
+
+        for variant, count in counts.items():
+            items = self.basket_ids_by_variant.get(variant)
+
+            if items is None and count < 1:
+                continue
+
+            if items is None or (count > len(items) and not items.prefix.startswith(self.__prefix + '-')):
+                # new items are only added to ranges of this instance,
+                # the ids of an other range are kept as extra ids
+                self.__ranges += 1
+                items = ItemRange('{}-{}'.format(self.__prefix, self.__ranges),
+                                  extra=tuple(items or ()))
+
+            items, new, old = items.resized(max(count, 0))
+
+            if not new and not old:
+                continue
+
             if isinstance(variant, CostumizedVariant):
-                additional = variant.additional_data
-                basketset = [(i, vid, additional) for i in ids]
+                add += [(i, variant.id, variant.additional_data) for i in new]
             else:
-                basketset = [(i, vid) for i in ids]
+                add += [(i, variant.id) for i in new]
 
-            self.obj = self.shop.api.basket_set(self.sessionid, basketset)
+            remove += old
+            changed[variant] = items
 
+        return add, remove, changed
 
-        if count < 1 and variant in self.basket_ids_by_variant:
-            self.obj = self.shop.api.basket_remove(self.sessionid, self.basket_ids_by_variant[variant])
+    def __apply(self, changed):
+        with self.__lock:
+            variants = dict(self.variants)
+            basket_ids_by_variant = dict(self.basket_ids_by_variant)
 
-            del self.basket_ids_by_variant[variant]
-            del self.variants[variant]
+            for variant, items in changed.items():
+                if items is not None and len(items) > 0:
+                    basket_ids_by_variant[variant] = items
+                    variants[variant] = len(items)
+                else:
+                    basket_ids_by_variant.pop(variant, None)
+                    variants.pop(variant, None)
 
-        else:
-            if variant in self.variants:
-                delta = count - self.variants[variant]
+            self.variants = variants
+            self.basket_ids_by_variant = basket_ids_by_variant
 
-                if delta > 0:
-                    ids = [uuid.uuid4().hex for unused in xrange(delta)]
-                    self.basket_ids_by_variant[variant] += ids
+    def __submit(self, job):
+        # the requests of a basket are send one after another
+        with self.__lock:
+            self.__queue.append(job)
+            self.__idle.clear()
 
-                    push_ids(ids)
+            if self.__running:
+                return
 
-                elif delta < 0:
-                    to_remove = self.basket_ids_by_variant[variant][:-delta]
-                    self.basket_ids_by_variant[variant] = self.basket_ids_by_variant[variant][-delta:]
+            self.__running = True
 
-                    self.obj = self.shop.api.basket_remove(self.sessionid, to_remove)
+        self.shop._basket_workers().apply_async(self.__drain)
 
-            else:
-                self.variants[variant] = count
+    def __drain(self):
+        while True:
+            with self.__lock:
+                if not self.__queue:
+                    self.__running = False
+                    self.__idle.set()
+                    return
+
+                job = self.__queue.popleft()
 
-                ids = [uuid.uuid4().hex for unused in xrange(count)]
-                self.basket_ids_by_variant[variant] = ids
+            self.__reconcile(*job)
 
-                push_ids(ids)
+    def __reconcile(self, add, remove, local, previous):
+        try:
+            obj = self.shop.api.basket_update(self.sessionid, add=add, remove=remove)
+
+            with self.__lock:
+                self.obj = obj
 
             self._check_obj()
+        except Exception as ex:
+            self.shop.log.exception('basket %s', self.sessionid)
+
+            if self.error is None:
+                self.error = ex
+
+            with self.__lock:
+                # the later changes were made on top of the failed one
+                dropped = list(self.__queue)
+                self.__queue.clear()
+
+                if isinstance(ex, BasketException):
+                    # the response tells, which items the Api took
+                    self.__rebuild()
+                else:
+                    for job in reversed(dropped):
+                        self.__apply(job[3])
+
+                    self.__apply(previous)
+
+        try:
+            self.__save()
+        except Exception as ex:
+            self.shop.log.exception('basket %s', self.sessionid)
+
+            if self.error is None:
+                self.error = ex
+
+        remote = dict((key, (self.obj or {}).get(key)) for key in Basket.TOTALS)
+
+        if local is not None and local != remote:
+            self.shop.log.warning('basket %s totals %s differ from %s', self.sessionid, local, remote)
+
+            if self.on_mismatch is not None:
+                try:
+                    self.on_mismatch(self, local, remote)
+                except Exception:
+                    self.shop.log.exception('')
+
+        with self.__lock:
+            # the totals of later changes are still the local ones
+            if not self.__queue:
+                self._totals = None
+
+    def local_totals(self):
+        """
+        Calculates the totals from the prices of the variants and the tax
+        rates of the last basket response, or the *tax* of the
+        *basket_pricing* option.
+
+        :returns: A dict with total_price, total_net and total_vat
+                  or None, if the price of a variant is unknown.
+        """
+        prices = {}
+        taxes = {}
+
+        with self.__lock:
+            variants = self.variants
+            obj = self.obj
+
+        for line in (obj or {}).get('order_lines', []):
+            if 'variant_id' in line:
+                prices[line['variant_id']] = line.get('total_price')
+                taxes[line['variant_id']] = line.get('tax')
 
+        default_tax = self.shop.config.basket_pricing.get('tax', 19.0)
+        totals = dict((key, 0) for key in Basket.TOTALS)
+
+        for variant, count in variants.items():
+            price = variant.obj.get('price', prices.get(variant.id))
+
+            if price is None:
+                return None
+
+            tax = taxes.get(variant.id) or default_tax
+            net = int(round(price / (1 + tax / 100.0)))
+
+            totals['total_price'] += price * count
+            totals['total_net'] += net * count
+            totals['total_vat'] += (price - net) * count
+
+        return totals
+
+    def wait(self):
+        """
+        Waits until all changes were send to the Api.
+
+        :raises Exception: The first error of sending the changes.
+        """
+        self.__idle.wait()
+
+        error, self.error = self.error, None
+
+        if error is not None:
+            raise error
+
+    def __save(self):
+        store = self.shop.basket_store
+
+        if store is None:
+            return
+
+        try:
+            with self.__lock:
+                self.version = store.cas(self.sessionid, self._state(), self.version)
+                return
+        except StoreConflict:
+            # an other process changed the basket at the same time,
+            # the Api already has the changes of both, so its basket wins
+            self.shop.log.warning('basket %s was changed concurrently', self.sessionid)
+
+        while True:
+            state, version = store.get(self.sessionid)
+            obj = self.shop.api.basket_get(self.sessionid)
+
+            try:
+                with self.__lock:
+                    self.obj = obj
+                    self.__rebuild()
+                    self.version = store.cas(self.sessionid, self._state(), version)
+                    return
+            except StoreConflict:
+                continue
+
+    def quantities(self):
+        """
+        Folds the order lines of the last basket response.
+
+        :returns: A dict with the count of items by variant id,
+                  item sets without a variant id are left out.
+        """
+        counts = {}
+
+        for line in self.obj['order_lines']:
+            vid = line.get('variant_id')
+
+            if vid is not None and 'error_message' not in line:
+                counts[vid] = counts.get(vid, 0) + 1
+
+        return counts
 
     def order(self, success_url, cancel_url=None, error_url=None):
         """
@@ -667,6 +1423,8 @@ class Basket(object):
         :param str error_url: this is a callback url if the order throwed exceptions.
         :returns: The url to the shop.
         """
+        self.wait()
+
         self.shop.log.info('order basket %s', self.sessionid)
         return self.shop.api.order(self.sessionid, success_url, cancel_url, error_url)
 
@@ -678,6 +1436,9 @@ class Basket(object):
 
         self.shop.api.basket_dispose(self.sessionid)
 
+        if self.shop.basket_store is not None:
+            self.shop.basket_store.delete(self.sessionid)
+
         del self.shop._baskets[self.sessionid]
 
 
@@ -689,6 +1450,33 @@ class ShopApi(object):
 
         If caching is not set to *null* in the config file, ShopApi will
         cache Factes and the Category-Tree.
+        The values are encoded by a :py:class:`aboutyou.cache.Codec`,
+        which is set by the *codec*, *level* and *threshold* keys of the
+        cache option.
+        With the *local* key an in-process :py:class:`aboutyou.cache.LocalCache`
+        is used in front of memcached, or alone if there are no *hosts*.
+        With *search* set to *False* the products of search results are not
+        cached and *write_behind* sets the seconds after which the changed
+        products of search results are written in one batch.
+
+        The *search_cache* option of the config enables the in-process
+        cache of search responses, its counters are available by
+        ``shop.search_cache.stats()``.
+
+        With the *snapshot* option of the config the category tree and the
+        facets are read from a local file, see :py:func:`save_snapshot`.
+
+        The *basket_store* option of the config keeps the state of the
+        baskets in a :py:mod:`aboutyou.store`, so every process can resume
+        a basket without asking the Api.
+        With *basket_pricing* the baskets show local totals right away,
+        differences to the totals of the Api are passed to the function
+        *on_basket_mismatch*, see :py:class:`aboutyou.shop.Basket`.
+
+        The *live* option of the config starts a
+        :py:class:`aboutyou.live.LivePoller` as ``shop.live``, which polls
+        the stock and price of every variant asked by
+        :py:func:`aboutyou.shop.Variant.live`.
 
     :param credentials: A :py:class:`aboutyou.config.Credentials` instance.
     :param config: A :py:class:`aboutyou.config.Config` instance.
@@ -704,28 +1492,218 @@ class ShopApi(object):
         self.__categorytree = None
         self.__category_ids = {}
         self.__category_names = {}
+        self.__category_order = []
+        self.__category_index = {}
 
         self.__facet_map = None
-        self.__facet_groups = []
+        self.__facet_raw = {}
+        self.__facet_names = {}
+        self.__facet_index = None
+        self.__attributes = {}
+        self.__attribute_facets = {}
+
+        # the raw responses the categories and facets are build from
+        self.__sources = {}
 
         self.__simple_colors = None
 
         self._baskets = {}
 
         self.cache = None
+        self.codec = Codec.from_config(self.config.cache)
+        self.cache_search = True
+        self.write_behind = None
 
         if self.config.cache is not None and len(self.config.cache) > 0:
-            try:
-                import pylibmc
+            remote = None
+            local = None
 
-                self.cache = pylibmc.Client(self.config.cache['hosts'],
+            if self.config.cache.get('hosts'):
+                try:
+                    import pylibmc
+
+                    remote = pylibmc.Client(self.config.cache['hosts'],
                                             binary=True,
                                             behaviors={"tcp_nodelay": True, "ketama": True})
-                self.cache.get('TEST_TOKEN')
-                self.log.info('use memcached via pylibmc')
-            except:
-                self.cache = None
-                self.log.exception('')
+                    remote.get('TEST_TOKEN')
+                    # the write behind and snapshot threads share the client
+                    remote = ClientPool(remote, self.config.cache.get('clients', 10))
+                    self.log.info('use memcached via pylibmc')
+                except:
+                    remote = None
+                    self.log.exception('')
+
+            if self.config.cache.get('local'):
+                local = LocalCache(**self.config.cache['local'])
+                self.log.info('use local cache')
+
+            if remote is not None and self.codec.name == 'marshal':
+                # the marshal format differs between python versions,
+                # so it is only used in the memory of this process
+                self.log.warning('the marshal codec is not used with memcached, use zlib')
+                self.codec = Codec('zlib', level=self.codec.level, threshold=self.codec.threshold)
+
+            if local is not None and remote is not None:
+                self.cache = TieredCache(local, remote)
+            elif local is not None:
+                self.cache = local
+            else:
+                self.cache = remote
+
+            self.cache_search = self.config.cache.get('search', True)
+
+            if self.cache is not None and self.config.cache.get('write_behind'):
+                self.write_behind = WriteBehind(self.cache_set_many, self.config.cache['write_behind'])
+
+        self.search_cache = None
+
+        if self.config.search_cache:
+            options = self.config.search_cache
+            self.search_cache = LocalCache(maxsize=options.get('maxsize', 1000),
+                                           maxbytes=options.get('maxbytes', 64 * 1024 * 1024),
+                                           ttl=options.get('ttl', 10))
+            # responses are only held in memory, so they are not compressed
+            self.__search_codec = Codec('marshal', threshold=float('inf'))
+            self.log.info('use search cache')
+
+        self.basket_store = None
+        self.on_basket_mismatch = None
+        self.__basket_pool = None
+
+        if self.config.basket_store:
+            self.basket_store = self.__basket_store(self.config.basket_store)
+
+        if self.config.snapshot and self.config.snapshot.get('path'):
+            self.__load_snapshot(self.config.snapshot)
+
+        self.live = None
+
+        if self.config.live:
+            options = self.config.live
+            self.live = LivePoller(self.api,
+                                   interval=options.get('interval', 60),
+                                   rate=options.get('rate'))
+            self.live.start()
+            self.log.info('use live poller')
+
+    def _basket_workers(self):
+        """
+        The threads which send the changes of optimistic baskets.
+        """
+        if self.__basket_pool is None:
+            self.__basket_pool = ThreadPool(self.config.workers or Config.PARAMS["workers"])
+
+        return self.__basket_pool
+
+    def __basket_store(self, options):
+        kind = options.get('type', 'memory')
+
+        self.log.info('use %s basket store', kind)
+
+        if kind == 'memory':
+            return MemoryStore()
+        elif kind == 'sqlite':
+            return SQLiteStore(options['path'])
+        elif kind == 'memcached':
+            import pylibmc
+
+            client = pylibmc.Client(options.get('hosts') or self.config.cache['hosts'],
+                                    binary=True,
+                                    behaviors={"tcp_nodelay": True, "ketama": True, "cas": True})
+
+            # the basket workers share the client with the request threads
+            client = ClientPool(client, options.get('clients', 10))
+
+            return MemcachedStore(client, options.get('timeout', 86400))
+        else:
+            raise ApiException("unknown basket store {}".format(kind))
+
+    def __load_snapshot(self, options):
+        path = options['path']
+        loaded = False
+
+        try:
+            snapshot = Snapshot(path)
+
+            try:
+                max_age = options.get('max_age', 86400)
+
+                if snapshot.section('app_id') != self.credentials.app_id:
+                    self.log.warning('snapshot %s is of an other app', path)
+                elif max_age and snapshot.age > max_age:
+                    self.log.warning('snapshot %s is %d seconds old', path, snapshot.age)
+                else:
+                    self.log.info('use snapshot %s', path)
+                    self._build_categories(snapshot.section('categorytree'))
+                    self._build_facets(snapshot.section('facets'))
+                    self.__sources['facettypes'] = snapshot.section('facettypes')
+                    loaded = True
+            finally:
+                snapshot.close()
+        except (IOError, OSError, SnapshotException):
+            self.log.warning('could not read snapshot %s', path, exc_info=True)
+
+        if options.get('refresh', True) or not loaded:
+            thread = threading.Thread(target=self.__refresh_snapshot, args=(path,),
+                                      name="aboutyou-snapshot")
+            thread.daemon = True
+            thread.start()
+
+    def __refresh_snapshot(self, path):
+        try:
+            self.refresh()
+            self.save_snapshot(path)
+        except Exception:
+            self.log.exception('could not refresh snapshot %s', path)
+
+    def refresh(self):
+        """
+        Gets the category tree and the facets from the Api
+        and replaces the current ones.
+        """
+        tree = self.api.categorytree()
+        facettypes = self.api.facettypes()
+        facets = []
+
+        for page in self.api.facets_all():
+            facets += page
+
+        self.cache_set('categorytree', tree)
+        self.cache_set('facettypes', facettypes)
+        self.cache_set('facets', facets)
+
+        self.__sources['facettypes'] = facettypes
+        self._build_categories(tree)
+        self._build_facets(facets)
+
+    def save_snapshot(self, path):
+        """
+        Writes the category tree and the facets into a snapshot file,
+        which is read on start by the *snapshot* option of the config.
+
+        :param str path: The path of the snapshot file.
+
+        .. code-block:: python
+
+            >>> shop.save_snapshot('/var/cache/aboutyou.snapshot')
+        """
+        if self.__categorytree is None:
+            self.__build_categories()
+
+        if self.__facet_map is None:
+            self.__build_facets()
+
+        facettypes = self.__sources.get('facettypes')
+
+        if facettypes is None:
+            facettypes = self.cache_get('facettypes') or self.api.facettypes()
+
+        write_snapshot(path, {'app_id': self.credentials.app_id,
+                              'categorytree': self.__sources['categorytree'],
+                              'facettypes': facettypes,
+                              'facets': self.__sources['facets']})
+
+        self.log.info('wrote snapshot %s', path)
 
     def __build_categories(self):
         tree = self.cache_get('categorytree')
@@ -738,44 +1716,238 @@ class ShopApi(object):
 
             self.cache_set('categorytree', tree)
 
-        def build(n):
+        self._build_categories(tree)
+
+    def _build_categories(self, tree):
+        # everything is build aside and swapped in at the end,
+        # so a refresh does not disturb the readers of the old tree
+        ids = {}
+        names = {}
+        order = []
+        index = {}
+
+        def build(n, ancestors):
             c = Category(self, n)
-            self.__category_ids[c.id] = c
-            self.__category_names[c.name] = c
-            c.sub_categories = [build(x) for x in n["sub_categories"]]
+            ids[c.id] = c
+            names[c.name] = c
+
+            # the descendants of c are order[pre + 1:end]
+            pre = len(order)
+            order.append(c.id)
+
+            path = ancestors + (c.id,)
+            c.sub_categories = [build(x, path) for x in n["sub_categories"]]
+
+            index[c.id] = (ancestors, pre, len(order))
             return c
 
-        self.__categorytree = [build(node) for node in tree]
+        categorytree = [build(node, ()) for node in tree]
+
+        self.__category_ids = ids
+        self.__category_names = names
+        self.__category_order = order
+        self.__category_index = index
+        self.__categorytree = categorytree
+        self.__sources['categorytree'] = tree
+
+    def _category_position(self, cid):
+        """
+        :returns: A tuple of the ancestor ids from the root on,
+                  the pre order position and the end of the subtree.
+        """
+        if self.__categorytree is None:
+            self.__build_categories()
+
+        return self.__category_index[cid]
 
     def __build_facets(self):
         facets = self.cache_get('facettypes')
+
+        if self.config.facet_fetch == 'group':
+            # the groups are fetched on their first use
+            if not facets:
+                facets = self.api.facettypes()
+                self.cache_set('facettypes', facets)
+
+            self.__sources['facettypes'] = facets
+            self._build_facets([])
+            return
+
         response = self.cache_get('facets')
 
-        if facets:
+        # a shop in group mode only caches the facet types
+        if facets and response is not None:
             self.log.info('use cached facets')
-        else:
-            facets = self.api.facettypes()
-            response = self.api.facets([])["facet"]
+            self.__sources['facettypes'] = facets
+            self._build_facets(response)
+            return
+
+        facets = self.api.facettypes()
+
+        # the pages are grouped as they arrive, no huge response is parsed,
+        # but they are only swapped in after the last one
+        facet_raw = {}
+        facet_names = {}
+        response = []
 
-            self.cache_set('facettypes', facets)
-            self.cache_set('facets', response)
+        for page in self.api.facets_all():
+            ShopApi.__group_facets(page, facet_raw, facet_names)
+            response += page
 
+        self.__sources['facettypes'] = facets
+        self.__set_facets(facet_raw, facet_names, response)
+
+        self.cache_set('facettypes', facets)
+        self.cache_set('facets', response)
+
+    def _build_facets(self, response):
+        """
+        Only groups the raw facets, the :py:class:`aboutyou.shop.FacetGroup`
+        and :py:class:`aboutyou.shop.Node` instances are build on the first
+        access of a group.
+        """
+        facet_raw = {}
+        facet_names = {}
+
+        ShopApi.__group_facets(response, facet_raw, facet_names)
+
+        self.__set_facets(facet_raw, facet_names, list(response))
+
+    def __set_facets(self, facet_raw, facet_names, response):
+        # everything is build aside and swapped in at the end,
+        # the facet map is the last, because it marks the facets as loaded
+        self.__facet_raw = facet_raw
+        self.__facet_names = facet_names
+        self.__facet_index = None
+        self.__attributes = {}
+        self.__attribute_facets = {}
+        self.__sources['facets'] = response
         self.__facet_map = {}
+
+    @staticmethod
+    def __group_facets(response, facet_raw, facet_names):
         for facet in response:
-            fobj = Node(self, facet)
-            group = self.__facet_map.get(fobj.group_name)
-            if group is None:
-                group = FacetGroup(fobj.id, fobj.group_name, {})
-                self.__facet_map[group.name] = group
-                self.__facet_map[group.id] = group
-                self.__facet_groups.append(group)
+            facets = facet_raw.get(facet['id'])
+
+            if facets is None:
+                facets = facet_raw[facet['id']] = []
+                facet_names[facet['group_name']] = facet['id']
+
+            facets.append(facet)
+
+    def __fetch_facet_groups(self, gids):
+        response = []
+        missing = []
+
+        for gid in gids:
+            facets = self.cache_get('facets.{}'.format(gid))
+
+            if facets is None:
+                missing.append(gid)
+            else:
+                response += facets
+
+        if missing:
+            self.log.info('get facet groups %s from Api', missing)
+            fetched = self.api.facets(group_ids=missing)["facet"]
+
+            for gid in missing:
+                self.cache_set('facets.{}'.format(gid), [f for f in fetched if f['id'] == gid])
+
+            response += fetched
+
+        ShopApi.__group_facets(response, self.__facet_raw, self.__facet_names)
+        self.__sources['facets'] += response
+        self.__facet_index = None
+
+    def __facet_group(self, facet_group):
+        group = self.__facet_map.get(facet_group)
+
+        if group is not None:
+            return group
+
+        gid = self.__facet_names.get(facet_group, facet_group)
+        facets = self.__facet_raw.get(gid)
 
+        if facets is None and self.config.facet_fetch == 'group':
+            if not isinstance(gid, int):
+                # the name of a group, which was not fetched yet
+                gid = getattr(FACET, str(gid).upper(), None)
+
+            if gid is not None:
+                self.__fetch_facet_groups([gid])
+                facets = self.__facet_raw.get(gid)
+
+        if facets is None:
+            raise KeyError(facet_group)
+
+        group = FacetGroup(gid, facets[0]['group_name'], {})
+
+        for facet in facets:
+            fobj = Node(self, facet)
             group.facets[fobj.facet_id] = fobj
 
+        # an other thread could have build the group meanwhile
+        group = self.__facet_map.setdefault(group.id, group)
+        self.__facet_map.setdefault(group.name, group)
+
+        return group
+
+    @staticmethod
+    def search_key(filter, result):
+        """
+        The key of a search response in the search cache.
+
+        The session is not part of the key, so all sessions share the
+        responses for the same filter, fields, sorting and page.
+
+        :returns: A hex digest of the canonical JSON of *filter* and *result*.
+        """
+        data = json.dumps([filter, result], sort_keys=True, separators=(',', ':'))
+
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def _search_lookup(self, filter, result):
+        """
+        :returns: The key and the cached response or None.
+        """
+        if self.search_cache is None:
+            return None, None
+
+        key = ShopApi.search_key(filter, result)
+        data = self.search_cache.get(key)
+
+        if data is None:
+            return key, None
+
+        self.log.debug('search cache hit %s', key)
+
+        # every caller gets its own copy, which it can change
+        return key, self.__search_codec.decode(data)
+
+    def _search_store(self, key, response):
+        if self.search_cache is not None:
+            self.search_cache.set(key, self.__search_codec.encode(response))
+
+    def _product_search(self, sessionid, filter, result):
+        """
+        Calls :py:func:`aboutyou.api.Api.product_search` or answers from
+        the search cache. The response with the count and facets and every
+        page of products are cached separately, because *offset* and *limit*
+        are part of *result*.
+        """
+        key, response = self._search_lookup(filter, result)
+
+        if response is None:
+            response = self.api.product_search(sessionid, filter=filter, result=result)
+            self._search_store(key, response)
+
+        return response
+
     def cache_set(self, key, value):
         if self.cache is not None:
             self.log.debug('cache %s', key)
-            self.cache.set(key, bz2.compress(json.dumps(value)), time=self.config.cache['timeout'])
+            self.cache.set(key, self.__encode(value), time=self.config.cache.get('timeout', 0))
 
     def cache_get(self, key):
         if self.cache is not None:
@@ -783,10 +1955,62 @@ class ShopApi(object):
 
             if data:
                 self.log.debug('get from cache %s', key)
-                return json.loads(bz2.decompress(data))
+                return self.__decode(key, data)
             else:
                 self.log.debug('cache could not finde %s', key)
 
+    def cache_set_many(self, mapping):
+        """
+        Stores several values with one cache request.
+
+        :param dict mapping: The values by their keys.
+        """
+        if self.cache is not None and len(mapping) > 0:
+            self.log.debug('cache %s keys', len(mapping))
+
+            data = dict((key, self.__encode(value)) for key, value in mapping.items())
+            self.cache.set_multi(data, time=self.config.cache.get('timeout', 0))
+
+    def cache_get_many(self, keys):
+        """
+        Gets several values with one cache request.
+
+        :param list keys: The keys to look up.
+        :returns: A dict with the found values by their keys,
+                  missing keys are left out.
+        """
+        if self.cache is None or len(keys) == 0:
+            return {}
+
+        data = self.cache.get_multi(keys)
+
+        self.log.debug('got %s of %s keys from cache', len(data), len(keys))
+
+        values = {}
+
+        for key, value in data.items():
+            if value:
+                value = self.__decode(key, value)
+
+                if value is not None:
+                    values[key] = value
+
+        return values
+
+    def __encode(self, value):
+        return self.codec.encode(value)
+
+    def __decode(self, key, data):
+        """
+        :returns: The value or None, if the data can not be decoded,
+                  like entries of an other python version.
+        """
+        try:
+            return self.codec.decode(data)
+        except Exception:
+            self.log.exception('could not decode cache entry %s', key)
+            return None
+
     def javascript_url(self):
         """
         Returns the url to the Aboutyou Javascript helper functions.
@@ -807,13 +2031,16 @@ class ShopApi(object):
         :returns: :py:class:`aboutyou.shop.Basket`
         """
         if sessionid in self._baskets:
-            return self._baskets[sessionid]
+            basket = self._baskets[sessionid]
         else:
             basket = Basket(self, sessionid)
 
             self._baskets[sessionid] = basket
 
-            return basket
+        # the basket could be changed by an other process
+        basket._sync()
+
+        return basket
 
     def categories(self):
         """
@@ -877,6 +2104,45 @@ class ShopApi(object):
 
         return self.__category_names[name]
 
+    def is_descendant(self, cid, ancestor):
+        """
+        Checks in constant time, if a category is below an other one.
+
+        :param cid: The id of the category.
+        :param ancestor: The id of the possible ancestor.
+        :returns: True if *cid* is in the subtree of *ancestor*,
+                  but not *ancestor* itself.
+
+        .. code-block:: python
+
+            >>> shop.is_descendant(200, 100)
+            True
+        """
+        unused, pre, end = self._category_position(ancestor)
+        position = self._category_position(cid)[1]
+
+        return pre < position < end
+
+    def ancestors(self, cid):
+        """
+        The path from the root to the parent of a category,
+        for example for a breadcrumb.
+
+        :param cid: The id of the category.
+        :returns: A list of :py:class:`aboutyou.shop.Category`,
+                  which is empty for a root category.
+        """
+        return [self.__category_ids[aid] for aid in self._category_position(cid)[0]]
+
+    def descendant_ids(self, cid):
+        """
+        :param cid: The id of the category.
+        :returns: The ids of all categories below the category in pre order.
+        """
+        unused, pre, end = self._category_position(cid)
+
+        return self.__category_order[pre + 1:end]
+
     def simple_colors(self):
         """
         Returns an array of facet colors which are a simple selection out
@@ -904,7 +2170,13 @@ class ShopApi(object):
         if self.__facet_map is None:
             self.__build_facets()
 
-        return self.__facet_groups
+        if self.config.facet_fetch == 'group':
+            missing = [gid for gid in self.__sources['facettypes'] if gid not in self.__facet_raw]
+
+            if missing:
+                self.__fetch_facet_groups(missing)
+
+        return [self.__facet_group(gid) for gid in list(self.__facet_raw)]
 
 
     def facet_group_by_id(self, facet_group):
@@ -921,14 +2193,99 @@ class ShopApi(object):
         if self.__facet_map is None:
             self.__build_facets()
 
-        return self.__facet_map[facet_group]
+        return self.__facet_group(facet_group)
 
 
+    def variant_attributes(self, obj):
+        """
+        Resolves the raw attributes of a variant.
+
+        The result is memoized, so all variants with the same attributes
+        share one :py:class:`aboutyou.shop.VariantAttributes` and the same
+        tuples of :py:class:`aboutyou.shop.Node`.
+
+        :param dict obj: The attributes like {"attributes_1": [12, 38]}.
+        :returns: A :py:class:`aboutyou.shop.VariantAttributes` instance.
+        """
+        key = tuple(sorted((name, tuple(value)) for name, value in obj.items()))
+        attributes = self.__attributes.get(key)
+
+        if attributes is None:
+            attributes = self.__attributes.setdefault(key, VariantAttributes(self, obj))
+
+        return attributes
+
+    def _attribute_facets(self, name, facet_ids):
+        """
+        :param str name: The key of an attribute, like "attributes_1".
+        :param list facet_ids: The facet ids of the attribute.
+        :returns: The :py:class:`aboutyou.shop.FacetGroup`
+                  and a tuple of its facets.
+        """
+        key = (name, tuple(facet_ids))
+        resolved = self.__attribute_facets.get(key)
+
+        if resolved is not None:
+            return resolved
+
+        facets = self.facet_group_by_id(int(name[len("attributes_"):]))
+
+        collection = []
+        for f in facet_ids:
+            g = facets.facets.get(f, None)
+
+            if g is None:
+                g = Node(self, {'id': facets.id,
+                                'name': 'unknown_{}'.format(f),
+                                'value': 'unknown_{}'.format(f),
+                                'facet_id': f})
+                facets.facets[f] = g
+
+            collection.append(g)
+
+        return self.__attribute_facets.setdefault(key, (facets, tuple(collection)))
+
+    def find_facets(self, text, prefix=False):
+        """
+        Finds facets of all groups by their name or value,
+        the case does not matter.
+
+        Only the groups of the found facets are build. With *facet_fetch*
+        set to *group* only the groups fetched so far are searched.
+
+        :param str text: The name or value, for example from an url.
+        :param bool prefix: If True, find the facets beginning with *text*.
+        :returns: A list of :py:class:`aboutyou.shop.Node`.
+
+        .. code-block:: python
+
+            >>> [(f.group_name, f.facet_id) for f in shop.find_facets('nike')]
+            [(u'brand', 272)]
+        """
+        if self.__facet_map is None:
+            self.__build_facets()
+
+        index = self.__facet_index
+
+        if index is None:
+            entries = []
+
+            for gid, facets in list(self.__facet_raw.items()):
+                for facet in facets:
+                    item = (gid, facet['facet_id'])
+                    entries.append((facet.get('name'), item))
+                    entries.append((facet.get('value'), item))
+
+            index = self.__facet_index = FacetIndex(entries)
+
+        return [self.__facet_group(gid)[fid] for gid, fid in index.find(text, prefix)]
+
     def products_by_id(self, pids, fields=['sale', 'active', 'default_variant']):
         """
         Gets a products by its id.
 
-        :param list pids: A list of product ids.
+        :param list pids: A list of product ids, which can be longer than
+                          two hundred ids, see :py:func:`aboutyou.api.Api.products`.
         :returns: A tuple of a dict of :py:class:`aboutyou.shop.Product` instances
                   and a dict with ids and error message which cause trouble.
 
@@ -943,41 +2300,99 @@ class ShopApi(object):
             {123: [u'product not found']}
 
         """
+        products, spid = self._cached_products(pids)
+        withError = {}
+
+        if len(spid) > 0:
+            response = self.api.products(ids=spid, fields=list(fields))
+            self._add_products(response, products, withError)
+
+        return products, withError
+
+    def _cached_products(self, pids):
+        """
+        Looks up products in the cache.
+
+        :returns: A tuple of a dict of the cached products and a list of
+                  the ids which have to be requested.
+        """
         spid = []
         products = {}
-        withError = {}
 
         # get products from cache or mark unknown products
         if self.cache is not None:
+            cached = self.cache_get_many([str(pid) for pid in pids])
+
             for pid in pids:
-                sid = str(pid)
-                p = self.cache_get(sid)
+                p = cached.get(str(pid))
 
                 if p is None:
-                    spid.append(sid)
+                    spid.append(pid)
                 else:
                     pro = Product(self, p)
                     products[pro.id] = pro
         else:
-            spid = [str(p) for p in pids]
+            spid = list(pids)
 
-        if len(spid) > 0:
-            response = self.api.products(ids=pids, fields=list(fields))
-            new = []
+        return products, spid
 
-            for pid, p in response["ids"].items():
-                if "error_message" in p:
-                    withError[int(pid)] = p['error_message']
-                else:
-                    product = Product(self, p)
-                    new.append(product)
-                    products[product.id] = product
+    def _add_products(self, response, products, withError):
+        """
+        Adds the products of a *products* response and caches them.
+        """
+        new = []
 
-            if self.cache is not None:
-                for n in new:
-                    self.cache_set(str(n.id), n.obj)
+        for pid, p in response["ids"].items():
+            if "error_message" in p:
+                withError[int(pid)] = p['error_message']
+            else:
+                product = Product(self, p)
+                new.append(product)
+                products[product.id] = product
 
-        return products, withError
+        self.cache_set_many(dict((str(n.id), n.obj) for n in new))
+
+    def prefetch(self, products, fields):
+        """
+        Fetches the fields of several products in one request,
+        products which already have all fields are left out.
+
+        :param list products: A list of :py:class:`aboutyou.shop.Product`.
+        :param list fields: The product fields, see :py:class:`aboutyou.constants.PRODUCT_FIELD`.
+
+        .. code-block:: python
+
+            >>> products = search.products[:24]
+            >>> shop.prefetch(products, [PRODUCT_FIELD.VARIANTS, PRODUCT_FIELD.DEFAULT_IMAGE])
+        """
+        catname = "categories.{}".format(self.credentials.app_id)
+        keys = [catname if f == PRODUCT_FIELD.CATEGORIES else f for f in fields]
+
+        missing = {}
+        for product in products:
+            if any(key not in product.obj for key in keys):
+                missing.setdefault(product.obj['id'], []).append(product)
+
+        if len(missing) == 0:
+            return
+
+        self.log.debug('prefetch %s for %s products', fields, len(missing))
+
+        response = self.api.products(ids=list(missing.keys()), fields=list(fields))
+        changed = {}
+
+        for pid, same in missing.items():
+            data = response["ids"].get(str(pid))
+
+            if data is None or "error_message" in data:
+                continue
+
+            for product in same:
+                product.obj.update(data)
+
+            changed[str(pid)] = same[0].obj
+
+        self.cache_set_many(changed)
 
     def products_by_ean(self, eans, fields=None):
         """
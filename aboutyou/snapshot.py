@@ -0,0 +1,159 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+A local snapshot file of the category tree and the facets, so a new
+:py:class:`aboutyou.shop.ShopApi` can start without asking the Api.
+
+The file starts with a fixed header, followed by a table of the sections
+and their data. Every section is encoded by a :py:class:`aboutyou.cache.Codec`,
+so the file is memory mapped and a section is only decoded, when it is used.
+
+.. code-block:: text
+
+    header   magic (7 bytes) version (uint16) created (double) sections (uint32)
+    table    name (16 bytes) offset (uint64) length (uint64) for every section
+    data     the encoded sections
+"""
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from .cache import Codec
+
+
+MAGIC = b'AYSNAP\x00'
+
+VERSION = 1
+"""The version of the file format, other versions are not read."""
+
+HEADER = struct.Struct('<7sHdI')
+ENTRY = struct.Struct('<16sQQ')
+
+
+class SnapshotException(Exception):
+    pass
+
+
+def write_snapshot(path, sections, codec=None):
+    """
+    Writes a snapshot file.
+
+    The file is written next to *path* and renamed afterwards, so readers
+    never see a half written snapshot.
+
+    :param str path: The path of the snapshot file.
+    :param dict sections: The JSON compatible values by their names.
+    :param codec: The :py:class:`aboutyou.cache.Codec`, default is zlib.
+    """
+    if codec is None:
+        codec = Codec('zlib', level=6, threshold=0)
+
+    names = sorted(sections)
+    data = [codec.encode(sections[name]) for name in names]
+
+    offset = HEADER.size + ENTRY.size * len(names)
+    table = []
+
+    for name, encoded in zip(names, data):
+        if len(name) > 16:
+            raise SnapshotException("section name {} is to long".format(name))
+
+        table.append(ENTRY.pack(name.encode('ascii'), offset, len(encoded)))
+        offset += len(encoded)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmppath = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as dst:
+            dst.write(HEADER.pack(MAGIC, VERSION, time.time(), len(names)))
+
+            for entry in table:
+                dst.write(entry)
+
+            for encoded in data:
+                dst.write(encoded)
+
+        os.rename(tmppath, path)
+    except:
+        os.unlink(tmppath)
+        raise
+
+
+class Snapshot(object):
+    """
+    A memory mapped snapshot file.
+
+    :param str path: The path of the snapshot file.
+    :raises SnapshotException: If the file is not a snapshot
+                               or has an other version.
+
+    .. code-block:: python
+
+        >>> snapshot = Snapshot('/var/cache/aboutyou.snapshot')
+        >>> snapshot.age
+        12.5
+        >>> tree = snapshot.section('categorytree')
+        >>> snapshot.close()
+    """
+    def __init__(self, path):
+        self.path = path
+        self.codec = Codec()
+
+        with open(path, 'rb') as src:
+            self.__data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self.__data) < HEADER.size:
+                raise SnapshotException("{} is not a snapshot".format(path))
+
+            magic, version, self.created, count = HEADER.unpack_from(self.__data, 0)
+
+            if magic != MAGIC:
+                raise SnapshotException("{} is not a snapshot".format(path))
+
+            if version != VERSION:
+                raise SnapshotException("snapshot version {} is not supported".format(version))
+
+            self.__sections = {}
+
+            for i in range(count):
+                name, offset, length = ENTRY.unpack_from(self.__data, HEADER.size + i * ENTRY.size)
+
+                if offset + length > len(self.__data):
+                    raise SnapshotException("{} is truncated".format(path))
+
+                self.__sections[name.rstrip(b'\x00').decode('ascii')] = (offset, length)
+        except:
+            self.__data.close()
+            raise
+
+    def __contains__(self, name):
+        return name in self.__sections
+
+    @property
+    def age(self):
+        """
+        The seconds since the snapshot was written.
+        """
+        return time.time() - self.created
+
+    def section(self, name):
+        """
+        Decodes a section.
+
+        :param str name: The name of the section.
+        :returns: The value of the section or None, if there is none.
+        """
+        if name not in self.__sections:
+            return None
+
+        offset, length = self.__sections[name]
+
+        return self.codec.decode(self.__data[offset:offset + length])
+
+    def close(self):
+        self.__data.close()
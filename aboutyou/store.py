@@ -0,0 +1,191 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+Stores for the state of :py:class:`aboutyou.shop.Basket` instances,
+so every process of a deployment can resume the basket of a session.
+
+Every stored state has a version. A state is only written by *cas*,
+if the version is still the one which was read,
+otherwise :py:class:`aboutyou.store.StoreConflict` is raised.
+
+.. code-block:: python
+
+    >>> store = SQLiteStore('/var/lib/aboutyou/baskets.db')
+    >>> state, version = store.get('s3ss10n')
+    >>> version = store.cas('s3ss10n', {'items': []}, version)
+"""
+import sqlite3
+import threading
+
+from .cache import Codec
+
+
+class StoreException(Exception):
+    pass
+
+
+class StoreConflict(StoreException):
+    """The state was changed by someone else since it was read."""
+    pass
+
+
+class MemoryStore(object):
+    """
+    Keeps the states in the memory of the process, for a single process
+    or tests.
+    """
+    def __init__(self):
+        self.codec = Codec()
+
+        self.__lock = threading.Lock()
+        self.__data = {}
+
+    def get(self, key):
+        """
+        :returns: A tuple of the state and its version,
+                  (None, 0) if there is no state.
+        """
+        data, version = self.__data.get(key, (None, 0))
+
+        if data is None:
+            return None, 0
+
+        return self.codec.decode(data), version
+
+    def cas(self, key, state, version):
+        """
+        Writes the state, if the stored version is still *version*.
+
+        :returns: The new version.
+        :raises StoreConflict: If the state was changed meanwhile.
+        """
+        data = self.codec.encode(state)
+
+        with self.__lock:
+            if self.__data.get(key, (None, 0))[1] != version:
+                raise StoreConflict(key)
+
+            self.__data[key] = (data, version + 1)
+
+        return version + 1
+
+    def delete(self, key):
+        with self.__lock:
+            self.__data.pop(key, None)
+
+
+class MemcachedStore(object):
+    """
+    Keeps the states in memcached and uses its compare-and-set.
+
+    :param client: A :py:class:`pylibmc.Client` with the behavior *cas*.
+    :param int timeout: Seconds a state is kept.
+    :param str prefix: The prefix of the memcached keys.
+    """
+    def __init__(self, client, timeout=86400, prefix='basket.'):
+        self.client = client
+        self.timeout = timeout
+        self.prefix = prefix
+        self.codec = Codec()
+
+    def get(self, key):
+        """
+        See :py:func:`aboutyou.store.MemoryStore.get`.
+        """
+        data = self.client.get(self.prefix + key)
+
+        if data is None:
+            return None, 0
+
+        value = self.codec.decode(data)
+
+        return value['state'], value['version']
+
+    def cas(self, key, state, version):
+        """
+        See :py:func:`aboutyou.store.MemoryStore.cas`.
+        """
+        key = self.prefix + key
+        data, token = self.client.gets(key)
+        current = self.codec.decode(data)['version'] if data is not None else 0
+
+        if current != version:
+            raise StoreConflict(key)
+
+        data = self.codec.encode({'version': version + 1, 'state': state})
+
+        if token is None:
+            stored = self.client.add(key, data, time=self.timeout)
+        else:
+            stored = self.client.cas(key, data, token, time=self.timeout)
+
+        if not stored:
+            raise StoreConflict(key)
+
+        return version + 1
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+class SQLiteStore(object):
+    """
+    Keeps the states in a SQLite database, which can be shared by the
+    processes of one host.
+
+    :param str path: The path of the database file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.codec = Codec()
+
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+        with self.__lock:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS baskets "
+                              "(key TEXT PRIMARY KEY, version INTEGER, state BLOB)")
+            self.__db.commit()
+
+    def get(self, key):
+        """
+        See :py:func:`aboutyou.store.MemoryStore.get`.
+        """
+        with self.__lock:
+            row = self.__db.execute("SELECT state, version FROM baskets WHERE key = ?",
+                                    (key,)).fetchone()
+
+        if row is None:
+            return None, 0
+
+        return self.codec.decode(bytes(row[0])), row[1]
+
+    def cas(self, key, state, version):
+        """
+        See :py:func:`aboutyou.store.MemoryStore.cas`.
+        """
+        data = sqlite3.Binary(self.codec.encode(state))
+
+        with self.__lock:
+            if version == 0:
+                cursor = self.__db.execute("INSERT OR IGNORE INTO baskets VALUES (?, 1, ?)",
+                                           (key, data))
+            else:
+                cursor = self.__db.execute("UPDATE baskets SET version = ?, state = ? "
+                                           "WHERE key = ? AND version = ?",
+                                           (version + 1, data, key, version))
+            self.__db.commit()
+
+        if cursor.rowcount != 1:
+            raise StoreConflict(key)
+
+        return version + 1
+
+    def delete(self, key):
+        with self.__lock:
+            self.__db.execute("DELETE FROM baskets WHERE key = ?", (key,))
+            self.__db.commit()
+
+    def close(self):
+        self.__db.close()
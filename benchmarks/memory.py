@@ -0,0 +1,134 @@
+#-*- encoding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+
+Measures the bytes per product and variant of the model objects of
+:py:mod:`aboutyou.shop` with the fixtures in *test/data*.
+
+The *dict* column rebuilds the same objects with a per-instance __dict__,
+as the models were before they got __slots__. The raw response dicts are
+loaded before measuring, so only the model objects are counted.
+
+.. code-block:: bash
+
+    $ python benchmarks/memory.py
+"""
+import copy
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aboutyou.config import Config, Credentials
+from aboutyou.shop import Product, ShopApi, Variant
+
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'test', 'data')
+COPIES = 200
+
+
+def read(filename):
+    with open(os.path.join(DATA, filename)) as src:
+        return src.read()
+
+
+def shop():
+    client = ShopApi(Credentials(110, '', ''), Config(pool=False))
+
+    def request(params):
+        if 'facet_types' in json.loads(params)[0]:
+            return read('facet-types.json')
+
+        return read('facets-all.json')
+
+    client.api.request = request
+    client.facet_groups()
+
+    return client
+
+
+class Dict(object):
+    pass
+
+
+def with_dict(obj, shared, memo=None):
+    """
+    Copies a slotted object and the containers and objects it owns into
+    objects with a __dict__. Objects in *shared*, like the facets, are
+    referenced and not copied.
+    """
+    if memo is None:
+        memo = {}
+
+    def convert(value):
+        if id(value) in memo:
+            return memo[id(value)]
+
+        if isinstance(value, list):
+            result = [convert(v) for v in value]
+        elif isinstance(value, dict):
+            result = dict((k, convert(v)) for k, v in value.items())
+        elif hasattr(type(value), '__slots__') and id(value) not in shared:
+            result = with_dict(value, shared, memo)
+        else:
+            return value
+
+        memo[id(value)] = result
+        return result
+
+    clone = Dict()
+    memo[id(obj)] = clone
+
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            if name.startswith('__'):
+                name = '_{}{}'.format(cls.__name__, name)
+
+            if hasattr(obj, name) and name != 'obj':
+                setattr(clone, name, convert(getattr(obj, name)))
+            elif name == 'obj':
+                clone.obj = obj.obj
+
+    return clone
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return after - before, objects
+
+
+def main():
+    client = shop()
+
+    raw = list(json.loads(read('products/products-full.json'))[0]['products']['ids'].values())
+    raw = [p for p in raw if 'variants' in p]
+    objs = [copy.deepcopy(p) for i in range(COPIES) for p in raw]
+    variant_objs = [v for p in objs for v in p['variants']]
+
+    shared = set(id(facet) for group in client.facet_groups() for facet in group)
+    shared.add(id(client))
+    rows = []
+
+    for name, build in [('product', lambda: [Product(client, obj) for obj in objs]),
+                        ('variant', lambda: [Variant(client, obj) for obj in variant_objs])]:
+        slotted, result = measure(build)
+        converted, unused = measure(lambda: [with_dict(o, shared) for o in result])
+
+        rows.append((name, converted // len(result), slotted // len(result)))
+
+    print('{} products with {} variants'.format(len(objs), len(variant_objs)))
+    print('{:>10} {:>10} {:>10}'.format('bytes', 'dict', 'slots'))
+
+    for row in rows:
+        print('{:>10} {:>10} {:>10}'.format(*row))
+
+
+if __name__ == '__main__':
+    main()
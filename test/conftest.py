@@ -5,15 +5,38 @@
 import json
 import os
 import pytest
+import sys
+import tempfile
+import threading
+import time
 
 from aboutyou.api import Api
 from aboutyou.auth import Auth
 from aboutyou.config import YAMLConfig, YAMLCredentials
 from aboutyou.shop import ShopApi
 
+if sys.version[0] == '2':
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+def write_credentials():
+    """
+    Writes the app credentials of the tests, all requests are mocked.
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'credentials.yaml')
+
+    with open(path, 'w') as dst:
+        dst.write('app_id: 110\napp_secret: "1234"\napp_token: "5678"\n')
+
+    return path
+
 
 config = YAMLConfig('examples/config.yaml')
-credentials = YAMLCredentials('slice-dice.yaml')
+credentials = YAMLCredentials(write_credentials())
 
 
 def read(filename):
@@ -53,7 +76,13 @@ def shop(monkeypatch):
 
     client.categories()
 
-    monkeypatch.setattr("aboutyou.api.Api.request", lambda self, params: read('facets-all.json'))
+    def request(self, params):
+        if 'facet_types' in json.loads(params)[0]:
+            return read('facet-types.json')
+
+        return read('facets-all.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
 
     client.facet_groups()
 
@@ -68,3 +97,53 @@ def session():
 @pytest.fixture
 def log(request, aboutyou):
     return aboutyou.log.getChild(request.function.__name__)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    peers = []
+    bodies = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            peers.append(self.client_address)
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            bodies.append(body)
+
+            if body == b'drop':
+                # closes the connection without an answer
+                self.close_connection = True
+                return
+
+            if body == b'slow':
+                time.sleep(1)
+
+            status = 500 if body == b'fail' else 200
+
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    httpd.peers = peers
+    httpd.bodies = bodies
+    httpd.url = 'http://127.0.0.1:{}/api'.format(httpd.server_port)
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
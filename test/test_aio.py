@@ -0,0 +1,162 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+import asyncio
+import json
+import pytest
+from pytest import raises
+
+from aboutyou.aio import AsyncApi, AsyncConnectionPool, AsyncShopApi
+from aboutyou.api import ApiException
+from aboutyou.pool import PoolException
+
+from conftest import config, credentials, read
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture
+def amock(monkeypatch):
+    def wrapper(filename):
+        async def request(self, params):
+            return read(filename)
+
+        monkeypatch.setattr("aboutyou.aio.AsyncApi.request", request)
+
+        return json.loads(read(filename))
+
+    return wrapper
+
+
+def test_pool_keep_alive(server):
+    async def requests():
+        pool = AsyncConnectionPool()
+
+        first = await pool.request(server.url, b'one', {})
+        second = await pool.request(server.url, b'two', {})
+
+        with raises(PoolException):
+            await pool.request(server.url, b'fail', {})
+
+        pool.clear()
+
+        return first, second
+
+    assert run(requests()) == (b'one', b'two')
+    assert server.peers[0] == server.peers[1]
+
+
+def test_pool_retry(server):
+    async def requests():
+        pool = AsyncConnectionPool(timeout=0.5)
+
+        await pool.request(server.url, b'one', {})
+
+        with raises(ConnectionResetError):
+            await pool.request(server.url, b'drop', {})
+
+        await pool.request(server.url, b'one', {})
+
+        with raises(asyncio.TimeoutError):
+            await pool.request(server.url, b'slow', {})
+
+        pool.clear()
+
+    run(requests())
+
+    assert server.bodies.count(b'drop') == 2
+    assert server.bodies.count(b'slow') == 1
+
+
+def test_facets_all(monkeypatch):
+    facets = [{"id": 0, "group_name": "brand", "facet_id": i} for i in range(450)]
+
+    async def request(self, params):
+        query = json.loads(params)[0]["facets"]
+        page = facets[query["offset"]:query["offset"] + query["limit"]]
+        return json.dumps([{"facets": {"facet": page, "hits": len(facets)}}])
+
+    monkeypatch.setattr("aboutyou.aio.AsyncApi.request", request)
+
+    pages = run(AsyncApi(credentials, config).facets_all([0]))
+
+    assert [len(page) for page in pages] == [200, 200, 50]
+    assert sum(pages, []) == facets
+
+
+def test_products(amock):
+    data = amock('products/products.json')
+    api = AsyncApi(credentials, config)
+
+    result = run(api.products([123, 456], fields=['variants']))
+
+    assert result == data[0]['products']
+
+
+def test_products_out_of_range():
+    api = AsyncApi(credentials, config)
+
+    with raises(ApiException):
+        run(api.products([]))
+
+
+def test_producteans(amock):
+    data = amock('products/products_eans.json')
+    api = AsyncApi(credentials, config)
+
+    result = run(api.product_eans([8806159322381]))
+
+    assert result == data[0]['products_eans']['eans']
+
+
+def test_shop_search(amock):
+    shop = AsyncShopApi(credentials, config)
+    amock('search/product_search.json')
+
+    async def search():
+        result = await shop.search('s3ss10n', filter={"categories": [100, 200]})
+        products = await shop.gather(result, 0, 2)
+
+        return result, products
+
+    result, products = run(search())
+
+    assert result.count == 1234
+    assert products[0].id == 123
+
+
+def test_products_chunks(monkeypatch):
+    async def request(self, params):
+        ids = json.loads(params)[0]['products']['ids']
+        assert len(ids) <= 200
+        return json.dumps([{'products': {'ids': dict((str(i), {'id': i}) for i in ids)}}])
+
+    monkeypatch.setattr("aboutyou.aio.AsyncApi.request", request)
+    api = AsyncApi(credentials, config)
+
+    result = run(api.products(list(range(450))))
+
+    assert len(result['ids']) == 450
+
+
+def test_coalesce(monkeypatch):
+    calls = []
+
+    async def request(self, params):
+        calls.append(params)
+        await asyncio.sleep(0.01)
+        return read('category-tree.json')
+
+    monkeypatch.setattr("aboutyou.aio.AsyncApi.request", request)
+    api = AsyncApi(credentials, config)
+
+    async def main():
+        return await asyncio.gather(*[api.categorytree() for unused in range(4)])
+
+    results = run(main())
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
@@ -3,11 +3,15 @@
 :Author:    Arne Simon [arne.simon@slice-dice.de]
 """
 from aboutyou.constants import FACET
-from aboutyou.api import ApiException
+from aboutyou.api import ApiException, SingleFlight
 
 import json
+import threading
+import time
 from pytest import raises
 
+from conftest import read
+
 
 def test_autocomplete(aboutyou, mock):
     data = mock('autocomplete-sho.json')
@@ -38,6 +42,16 @@ class TestBasket:
 
             assert result == data[0]['basket']
 
+    def test_update(self, aboutyou, session, monkeypatch):
+        def request(self, params):
+            lines = json.loads(params)[0]['basket']['order_lines']
+            assert lines == [{'delete': 'my4813890'}, {'id': 'id1', 'variant_id': 4719964}]
+            return read('basket/basket.json')
+
+        monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+        aboutyou.basket_update(session, add=[('id1', 4719964)], remove=['my4813890'])
+
     def test_get(self, aboutyou, session, mock):
         data = mock('basket/basket.json')
         result = aboutyou.basket_get(session)
@@ -111,6 +125,22 @@ def test_factes_out_of_bound(aboutyou):
         aboutyou.facets([FACET.BRAND], offset=-1)
 
 
+def test_facets_all(aboutyou, monkeypatch):
+    facets = [{"id": 0, "group_name": "brand", "facet_id": i} for i in range(450)]
+
+    def request(self, params):
+        query = json.loads(params)[0]["facets"]
+        page = facets[query["offset"]:query["offset"] + query["limit"]]
+        return json.dumps([{"facets": {"facet": page, "hits": len(facets)}}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    pages = list(aboutyou.facets_all([FACET.BRAND]))
+
+    assert [len(page) for page in pages] == [200, 200, 50]
+    assert sum(pages, []) == facets
+
+
 def test_facettypes(aboutyou, mock):
     data = mock('facet-types.json')
     result = aboutyou.facettypes()
@@ -129,8 +159,18 @@ def test_livevariant_out_of_bound(aboutyou):
     with raises(ApiException):
         aboutyou.live_variant([])
 
-    with raises(ApiException):
-        aboutyou.live_variant([5652922]*201)
+
+def test_livevariant_chunks(aboutyou, monkeypatch):
+    def request(self, params):
+        ids = json.loads(params)[0]['live_variant']['ids']
+        assert len(ids) <= 200
+        return json.dumps([{'live_variant': dict((str(i), {'id': i}) for i in ids)}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    result = aboutyou.live_variant(list(range(450)))
+
+    assert len(result) == 450
 
 
 def test_child_apps(aboutyou, mock):
@@ -151,8 +191,22 @@ def test_products_out_of_range(aboutyou):
     with raises(ApiException):
         aboutyou.products([])
 
-    with raises(ApiException):
-        aboutyou.products([123]*201)
+
+def test_products_chunks(aboutyou, monkeypatch):
+    def request(self, params):
+        ids = json.loads(params)[0]['products']['ids']
+        assert len(ids) <= 200
+        products = dict((str(i), {'id': i}) for i in ids)
+        products['0'] = {'error_message': ['product not found']}
+        return json.dumps([{'products': {'pageHash': 'abc', 'ids': products}}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    result = aboutyou.products(list(range(1, 402)))
+
+    assert len(result['ids']) == 402
+    assert result['ids']['401'] == {'id': 401}
+    assert 'error_message' in result['ids']['0']
 
 
 def test_producteans(aboutyou, mock):
@@ -166,8 +220,12 @@ def test_producteans_ot_of_range(aboutyou):
     with raises(ApiException):
         aboutyou.product_eans([])
 
-    with raises(ApiException):
-        aboutyou.product_eans([8806159322381]*201)
+
+def test_producteans_chunks(aboutyou, mock):
+    data = mock('products/products_eans.json')
+    result = aboutyou.product_eans([8806159322381]*201)
+
+    assert result == data[0]['products_eans']['eans'] * 2
 
 
 def test_productsearch(aboutyou, session, mock):
@@ -175,3 +233,113 @@ def test_productsearch(aboutyou, session, mock):
     result = aboutyou.product_search(session)
 
     assert result == data[0]['product_search']
+
+
+def test_coalesce(aboutyou, session, monkeypatch):
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def request(self, params):
+        calls.append(params)
+        started.set()
+        release.wait(5)
+        return read('category-tree.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(aboutyou.categorytree()))
+               for unused in range(4)]
+
+    threads[0].start()
+    started.wait(5)
+
+    for thread in threads[1:]:
+        thread.start()
+
+    # let the other threads join the running request
+    time.sleep(0.2)
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert len(aboutyou.flights) == 0
+
+
+def test_coalesce_mutating(aboutyou, session, mock):
+    mock('basket/basket.json')
+    flights = aboutyou.flights = SingleFlight()
+
+    def fail(key, func):
+        raise AssertionError("basket must not be coalesced")
+
+    flights.do = fail
+
+    aboutyou.basket_get(session)
+
+
+def test_mutating_not_retried(aboutyou, session, monkeypatch):
+    retries = []
+
+    def request(self, url, body, headers, retry=True):
+        retries.append(retry)
+        cmd = list(json.loads(body.decode('utf-8'))[0])[0]
+        return json.dumps([{cmd: {}}]).encode('utf-8')
+
+    monkeypatch.setattr("aboutyou.pool.ConnectionPool.request", request)
+
+    aboutyou.send('basket', {'session_id': session})
+    aboutyou.send('facet_types', {})
+
+    assert retries == [False, True]
+
+
+def test_single_flight_error():
+    flights = SingleFlight()
+
+    def fail():
+        raise ApiException("boom")
+
+    with raises(ApiException):
+        flights.do('key', fail)
+
+    assert flights.do('key', lambda: 1) == 1
+
+
+def test_batch(aboutyou, monkeypatch):
+    tree = json.loads(read('category-tree.json'))[0]
+    types = json.loads(read('facet-types.json'))[0]
+    error = {"products": {"error_message": "products error"}}
+
+    def request(self, params):
+        assert [list(c.keys())[0] for c in json.loads(params)] == ['category_tree', 'facet_types', 'products']
+        return json.dumps([tree, types, error])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    with aboutyou.batch() as batch:
+        tree_result = batch.categorytree()
+        types_result = batch.facettypes()
+        products_result = batch.products([123])
+
+    assert len(batch) == 3
+    assert tree_result.result() == tree['category_tree']
+    assert types_result.result() == types['facet_types']
+
+    with raises(ApiException):
+        products_result.result()
+
+    with raises(ApiException):
+        batch.send()
+
+
+def test_batch_not_batchable(aboutyou, session):
+    batch = aboutyou.batch()
+
+    with raises(ApiException):
+        batch.order(session, 'https://success.com')
@@ -0,0 +1,147 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+import bz2
+import json
+import threading
+import time
+from pytest import raises
+
+from aboutyou.cache import CacheException, ClientPool, Codec, LocalCache, TieredCache, WriteBehind
+from aboutyou.config import Config
+from aboutyou.shop import ShopApi
+
+from conftest import credentials, read
+
+
+PRODUCT = json.loads(read('products/products-full.json'))[0]['products']
+
+
+def test_codecs():
+    for name in Codec.NAMES:
+        codec = Codec(name)
+
+        assert codec.decode(codec.encode(PRODUCT)) == PRODUCT
+
+
+def test_threshold():
+    codec = Codec('zlib', threshold=256)
+
+    assert codec.encode({'id': 1})[:1] == Codec.JSON
+    assert codec.encode(PRODUCT)[:1] == Codec.ZLIB_JSON
+
+
+def test_bz2_entries():
+    data = bz2.compress(json.dumps(PRODUCT).encode('utf-8'))
+
+    assert Codec().decode(data) == PRODUCT
+
+
+def test_from_config():
+    codec = Codec.from_config({'hosts': [], 'codec': 'marshal', 'level': 9})
+
+    assert codec.name == 'marshal'
+    assert codec.level == 9
+
+    assert Codec.from_config(None).name == 'zlib'
+
+    with raises(CacheException):
+        Codec.from_config({'codec': 'lzma'})
+
+
+def test_local_cache_lru():
+    cache = LocalCache(maxsize=2)
+
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    cache.get('a')
+    cache.set('c', b'3')
+
+    assert cache.get_multi(['a', 'b', 'c']) == {'a': b'1', 'c': b'3'}
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 1
+
+
+def test_local_cache_bytes():
+    cache = LocalCache(maxbytes=4)
+
+    cache.set_multi({'a': b'12', 'b': b'34'})
+    cache.set('c', b'5')
+
+    assert len(cache) == 2
+    assert cache.stats()['bytes'] == 3
+
+
+def test_local_cache_ttl():
+    cache = LocalCache(ttl=-1)
+
+    cache.set('a', b'1')
+
+    assert cache.get('a') is None
+
+
+def test_tiered_cache():
+    remote = LocalCache()
+    remote.set('a', b'1')
+    cache = TieredCache(LocalCache(), remote)
+
+    assert cache.get_multi(['a', 'b']) == {'a': b'1'}
+    assert cache.local.get('a') == b'1'
+
+
+def test_write_behind():
+    written = []
+    behind = WriteBehind(written.append, interval=60, batch=2)
+
+    behind.put({'a': 1})
+
+    assert len(behind) == 1
+    assert written == []
+
+    behind.flush()
+
+    assert written == [{'a': 1}]
+
+
+def test_broken_entries():
+    shop = ShopApi(credentials, Config(cache={'local': {'maxsize': 10}, 'codec': 'marshal'}))
+
+    shop.cache_set('good', {'id': 1})
+    shop.cache.set('bad', b'm\xff\x00')
+
+    assert shop.cache_get('bad') is None
+    assert shop.cache_get_many(['good', 'bad']) == {'good': {'id': 1}}
+
+
+def test_client_pool():
+    class Client(object):
+        busy = False
+        clones = []
+
+        def clone(self):
+            clone = Client()
+            Client.clones.append(clone)
+            return clone
+
+        def get(self, key):
+            assert not self.busy
+            self.busy = True
+            time.sleep(0.01)
+            self.busy = False
+            return key
+
+    cache = ClientPool(Client(), size=2)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a'))) for i in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results == ['a'] * 8
+    assert len(Client.clones) == 1
@@ -0,0 +1,156 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+from aboutyou.config import Config
+from aboutyou.live import LivePoller
+from aboutyou.shop import ShopApi
+
+import json
+import threading
+
+from conftest import credentials
+
+
+class FakeApi(object):
+    def __init__(self):
+        self.stock = {}
+        self.price = {}
+        self.requests = []
+
+    def live_variant(self, ids):
+        self.requests.append(list(ids))
+
+        return dict((str(i), {'id': i, 'available_stock': self.stock[i], 'price': self.price[i]})
+                    for i in ids if i in self.stock)
+
+
+def test_poll():
+    api = FakeApi()
+    poller = LivePoller(api)
+
+    for i in range(450):
+        api.stock[i] = 5
+        api.price[i] = 1000
+
+    poller.register(range(450))
+    poller.register([0, 1])
+
+    assert len(poller) == 450
+    assert poller.stock(0) is None
+
+    poller.poll()
+
+    assert [len(ids) for ids in api.requests] == [200, 200, 50]
+    assert poller.stock(449) == 5
+    assert poller.price(449) == 1000
+
+
+def test_events():
+    api = FakeApi()
+    poller = LivePoller(api)
+    events = []
+    drops = []
+
+    api.stock.update({1: 3, 2: 0, 3: 1})
+    api.price.update({1: 1000, 2: 500, 3: 700})
+
+    poller.register([1, 2, 3])
+    poller.subscribe(lambda *event: events.append(event))
+    poller.subscribe(lambda *event: drops.append(event), [LivePoller.PRICE_DROP])
+
+    poller.poll()
+
+    assert events == []
+
+    api.stock.update({1: 0, 2: 4})
+    api.price[1] = 800
+    del api.stock[3]
+
+    poller.poll()
+
+    assert sorted(events) == [(LivePoller.BACK_IN_STOCK, 2, 0, 4),
+                              (LivePoller.PRICE_DROP, 1, 1000, 800),
+                              (LivePoller.STOCK_OUT, 1, 3, 0),
+                              (LivePoller.STOCK_OUT, 3, 1, 0)]
+    assert drops == [(LivePoller.PRICE_DROP, 1, 1000, 800)]
+
+
+def test_unregister():
+    api = FakeApi()
+    poller = LivePoller(api)
+
+    api.stock.update({1: 1, 2: 2, 3: 3})
+    api.price.update({1: 10, 2: 20, 3: 30})
+
+    poller.register([1, 2, 3])
+    poller.poll()
+    poller.unregister([1, 4])
+
+    assert 1 not in poller
+    assert len(poller) == 2
+    assert poller.stock(1) is None
+    assert poller.stock(3) == 3
+    assert poller.price(2) == 20
+
+
+def test_start_stop():
+    api = FakeApi()
+    api.stock[1] = 1
+    api.price[1] = 10
+
+    polled = threading.Event()
+    poll = api.live_variant
+
+    def live_variant(ids):
+        try:
+            return poll(ids)
+        finally:
+            polled.set()
+
+    api.live_variant = live_variant
+
+    poller = LivePoller(api, interval=60)
+    poller.register([1])
+    poller.start()
+
+    assert polled.wait(5)
+
+    poller.stop()
+
+    assert poller.stock(1) == 1
+
+
+def test_variant_live(shop, mock, monkeypatch):
+    mock('products/products-full.json')
+    products, with_errors = shop.products_by_id([123, 456])
+    variant = products[456].variants[0]
+
+    requests = []
+
+    def request(self, params):
+        ids = json.loads(params)[0]['live_variant']['ids']
+        requests.append(ids)
+        return json.dumps([{'live_variant': dict((str(i), {'id': i, 'available_stock': 2, 'price': 995})
+                                                 for i in ids)}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    assert variant.live()['available_stock'] == 2
+
+    shop.live = LivePoller(shop.api)
+
+    assert variant.live() == {'id': variant.id, 'available_stock': 2, 'price': 995}
+    assert variant.live() == {'id': variant.id, 'available_stock': 2, 'price': 995}
+    assert requests == [[variant.id], [variant.id]]
+    assert variant.id in shop.live
+
+
+def test_config():
+    shop = ShopApi(credentials, Config(live={'interval': 60, 'rate': 5}))
+
+    try:
+        assert shop.live.interval == 60
+        assert shop.live.rate == 5
+    finally:
+        shop.live.stop()
@@ -0,0 +1,95 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+from aboutyou.api import Api
+from aboutyou.pool import ConnectionPool, PoolException, proxy_for
+
+import socket
+import sys
+import time
+from pytest import raises
+
+from conftest import config, credentials
+
+if sys.version[0] == '2':
+    from urllib2 import HTTPError
+else:
+    from urllib.error import HTTPError
+
+
+def test_keep_alive(server):
+    pool = ConnectionPool()
+
+    assert pool.request(server.url, b'one', {}) == b'one'
+    assert pool.request(server.url, b'two', {}) == b'two'
+
+    assert server.peers[0] == server.peers[1]
+
+    pool.clear()
+
+
+def test_idle_eviction(server):
+    pool = ConnectionPool(idle=0)
+
+    pool.request(server.url, b'one', {})
+    time.sleep(0.01)
+    pool.request(server.url, b'two', {})
+
+    assert server.peers[0] != server.peers[1]
+
+
+def test_error_status(server):
+    pool = ConnectionPool()
+
+    with raises(PoolException) as error:
+        pool.request(server.url, b'fail', {})
+
+    assert error.value.status == 500
+    assert isinstance(error.value, HTTPError)
+    assert error.value.code == 500
+
+    pool.clear()
+
+
+def test_proxy(monkeypatch):
+    monkeypatch.setenv('http_proxy', 'http://proxy.example.com:3128')
+    monkeypatch.setenv('no_proxy', '')
+
+    assert proxy_for('http://shop.example.com/api') == 'http://proxy.example.com:3128'
+    assert Api(credentials, config).pool is None
+
+    monkeypatch.delenv('http_proxy')
+
+    assert proxy_for('http://shop.example.com/api') is None
+    assert Api(credentials, config).pool is not None
+
+
+def test_stale_connection(server):
+    pool = ConnectionPool()
+
+    pool.request(server.url, b'one', {})
+
+    with raises(Exception):
+        pool.request(server.url, b'drop', {})
+
+    # once on the reused and once on a new connection
+    assert server.bodies.count(b'drop') == 2
+
+    pool.request(server.url, b'one', {})
+
+    with raises(Exception):
+        pool.request(server.url, b'drop', {}, retry=False)
+
+    assert server.bodies.count(b'drop') == 3
+
+
+def test_timeout_not_retried(server):
+    pool = ConnectionPool(timeout=0.5)
+
+    pool.request(server.url, b'one', {})
+
+    with raises(socket.timeout):
+        pool.request(server.url, b'slow', {})
+
+    assert server.bodies.count(b'slow') == 1
@@ -3,10 +3,40 @@
 :Author:    Arne Simon [arne.simon@slice-dice.de]
 """
 from aboutyou.api import ApiException
-from aboutyou.constants import FACET
-from aboutyou.shop import Node
+from aboutyou.constants import FACET, PRODUCT_FIELD
+from aboutyou.cache import LocalCache
+from aboutyou.config import Config
+from aboutyou.shop import BasketException, ItemRange, Node, ShopApi
 from pytest import raises
 
+from conftest import credentials, read
+
+import json
+import threading
+
+
+class Memcache(object):
+    """A dict with the part of the pylibmc interface ShopApi uses."""
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append('get')
+        return self.data.get(key)
+
+    def set(self, key, value, time=0):
+        self.calls.append('set')
+        self.data[key] = value
+
+    def get_multi(self, keys):
+        self.calls.append('get_multi')
+        return dict((k, self.data[k]) for k in keys if k in self.data)
+
+    def set_multi(self, mapping, time=0):
+        self.calls.append('set_multi')
+        self.data.update(mapping)
+
 
 def test_categories(shop):
     tree = shop.categories()
@@ -33,6 +63,24 @@ def test_category_by_id(shop):
     assert cat.name == 'Main Category 2'
 
 
+def test_category_index(shop):
+    assert shop.is_descendant(210, 200)
+    assert not shop.is_descendant(200, 200)
+    assert not shop.is_descendant(210, 100)
+    assert not shop.is_descendant(200, 210)
+
+    assert [c.id for c in shop.ancestors(220)] == [200]
+    assert shop.ancestors(100) == []
+
+    assert shop.descendant_ids(200) == [210, 220]
+    assert shop.descendant_ids(100) == []
+
+    category = shop.category_by_id(210)
+    assert category.parent.id == 200
+    assert category.depth == 1
+    assert category.parent.parent is None
+
+
 def test_facet_groups(shop):
     groups = shop.facet_groups()
 
@@ -45,6 +93,100 @@ def test_facet_group_by_id(shop):
     assert group.id == FACET.COLOR
 
 
+def test_find_facets(shop):
+    colors = shop.facet_group_by_id('color')
+
+    assert [f.facet_id for f in colors.find('DUNKELBLAU')] == [505]
+    assert 504 in [f.facet_id for f in colors.find('rot/', prefix=True)]
+    assert colors.find('no such color') == []
+
+    assert [f.facet_id for f in shop.find_facets('nike')] == [272]
+    assert [f.facet_id for f in shop.find_facets('Nik', prefix=True)] == [272, 691, 1367, 4120, 1575, 1718]
+    assert shop.find_facets('nike')[0].group_name == 'brand'
+
+
+def test_facet_group_fetch(monkeypatch):
+    shop = ShopApi(credentials, Config(facet_fetch='group'))
+    facets = json.loads(read('facets-all.json'))[0]['facets']['facet']
+
+    requests = []
+
+    def request(self, params):
+        command = json.loads(params)[0]
+        requests.append(command)
+
+        if 'facet_types' in command:
+            return read('facet-types.json')
+
+        gids = command['facets']['group_ids']
+        return json.dumps([{'facets': {'facet': [f for f in facets if f['id'] in gids]}}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    colors = shop.facet_group_by_id('color')
+    brands = shop.facet_group_by_id(FACET.BRAND)
+
+    assert colors.id == FACET.COLOR
+    assert brands.name == 'brand'
+    assert shop.facet_group_by_id(FACET.COLOR) is colors
+    assert [c['facets']['group_ids'] for c in requests if 'facets' in c] == [[FACET.COLOR], [FACET.BRAND]]
+
+    with raises(KeyError):
+        shop.facet_group_by_id('unknown')
+
+
+def test_facets_page_failure(monkeypatch):
+    shop = ShopApi(credentials, Config())
+    facets = json.loads(read('facets-all.json'))[0]['facets']['facet']
+    failures = [IOError("connection reset")]
+
+    def request(self, params):
+        command = json.loads(params)[0]
+
+        if 'facet_types' in command:
+            return read('facet-types.json')
+
+        query = command['facets']
+
+        if query['offset'] > 0 and failures:
+            raise failures.pop()
+
+        page = facets[query['offset']:query['offset'] + query['limit']]
+        return json.dumps([{'facets': {'facet': page, 'hits': len(facets)}}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    with raises(IOError):
+        shop.facet_group_by_id('color')
+
+    assert shop.facet_group_by_id('color').id == FACET.COLOR
+    assert len(shop.facet_groups()) == 53
+
+
+def test_facets_shared_cache(monkeypatch):
+    grouped = ShopApi(credentials, Config(cache={'local': {'maxsize': 100}}, facet_fetch='group'))
+    shop = ShopApi(credentials, Config(cache={'local': {'maxsize': 100}}))
+    shop.cache = grouped.cache
+
+    facets = json.loads(read('facets-all.json'))[0]['facets']['facet']
+
+    def request(self, params):
+        command = json.loads(params)[0]
+
+        if 'facet_types' in command:
+            return read('facet-types.json')
+
+        gids = command['facets'].get('group_ids')
+        return json.dumps([{'facets': {'facet': [f for f in facets if gids is None or f['id'] in gids],
+                                       'hits': len(facets)}}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    grouped.facet_group_by_id('color')
+
+    assert len(shop.facet_groups()) == 53
+
+
 def test_products_by_id(shop, mock):
     mock('products/products-full.json')
 
@@ -64,6 +206,55 @@ def test_products_by_id(shop, mock):
     assert p.styles is not None
 
 
+def test_variant_attributes(shop, mock):
+    mock('products/products-full.json')
+    products, with_errors = shop.products_by_id([123, 456])
+
+    first, second = products[456].variants[:2]
+
+    assert first._attributes is None
+
+    assert first.attributes['color'] is second.attributes['color']
+    assert first.attributes['color'] is first.attributes[FACET.COLOR]
+    assert first.attributes['brand'][0].facet_id == 264
+    assert first.attributes['unknown'] == ()
+
+    same = shop.variant_attributes(dict(first.obj['attributes']))
+    assert same is first.attributes
+
+
+def test_products_by_id_cached(shop, mock, monkeypatch):
+    mock('products/products-full.json')
+    shop.cache = Memcache()
+    monkeypatch.setattr(shop.config, 'cache', {'timeout': 60})
+
+    products, with_errors = shop.products_by_id([123, 456])
+
+    assert shop.cache.calls == ['get_multi', 'set_multi']
+
+    def request(self, params):
+        raise AssertionError('products should come from the cache')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    cached, with_errors = shop.products_by_id([123, 456])
+
+    assert shop.cache.calls == ['get_multi', 'set_multi', 'get_multi']
+    assert sorted(cached.keys()) == sorted(products.keys())
+
+
+def test_local_cache(mock):
+    shop = ShopApi(credentials, Config(cache={'local': {'maxsize': 100}}))
+
+    assert isinstance(shop.cache, LocalCache)
+
+    mock('products/products-full.json')
+    shop.products_by_id([123, 456])
+    shop.products_by_id([123, 456])
+
+    assert shop.cache.stats()['hits'] == 2
+
+
 def test_products_by_ean(shop, mock):
     mock('products/products_eans.json')
 
@@ -85,6 +276,166 @@ def test_search(shop, session, mock):
         pass
 
 
+def test_search_readahead(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    result = shop.search(session)
+
+    def request(self, params):
+        offset = json.loads(params)[0]['product_search']['result']['offset']
+        response = json.loads(read('search/product_search.json'))
+        for i, product in enumerate(response[0]['product_search']['products']):
+            product['id'] = offset + i
+        return json.dumps(response)
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    ids = [product.id for product in result.products.iter(readahead=3)]
+
+    assert ids == [offset + i for offset in range(0, 1234, 200) for i in range(2)]
+
+
+def test_search_slicing(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    result = shop.search(session)
+
+    windows = []
+
+    def request(self, params):
+        window = json.loads(params)[0]['product_search']['result']
+        windows.append((window['offset'], window['limit']))
+
+        response = json.loads(read('search/product_search.json'))
+        template = response[0]['product_search']['products'][0]
+        response[0]['product_search']['products'] = [dict(template, id=window['offset'] + i)
+                                                     for i in range(window['limit'])]
+        return json.dumps(response)
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    assert [p.id for p in result.products[1000:1024]] == list(range(1000, 1024))
+    assert windows == [(1000, 24)]
+
+    del windows[:]
+    assert [p.id for p in result.products[990:1030]] == list(range(990, 1030))
+    assert sorted(windows) == [(990, 10), (1024, 6)]
+
+    del windows[:]
+    assert [p.id for p in result.products[-3:]] == [1231, 1232, 1233]
+    assert result.products[-1].id == 1233
+    assert result.products[1000].id == 1000
+    assert windows == [(1231, 3)]
+
+    del windows[:]
+    assert [p.id for p in result.products[0:600:100]] == [0, 100, 200, 300, 400, 500]
+    assert sorted(windows) == [(0, 1), (100, 1), (200, 1), (300, 1), (400, 1), (500, 1)]
+
+    del windows[:]
+    assert len(result.products[0:450]) == 450
+    assert sorted(windows) == [(1, 199), (201, 199), (401, 49)]
+
+    del windows[:]
+    assert [p.id for p in result.products[600:1000:2]] == list(range(600, 1000, 2))
+    assert windows == [(600, 199), (800, 189)]
+
+    with raises(IndexError):
+        result.products[1234]
+
+
+def test_search_response_cache(session, monkeypatch):
+    shop = ShopApi(credentials, Config(search_cache={'ttl': 60, 'maxsize': 100}))
+
+    requests = []
+
+    def request(self, params):
+        requests.append(json.loads(params)[0]['product_search'])
+        return read('search/product_search.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    first = shop.search(session, filter={"categories": [100, 200]})
+    first.products.gather(0, 2)
+
+    second = shop.search('other-session', filter={"categories": [100, 200]})
+    second.products.gather(0, 2)
+    second.products.gather(2, 2)
+
+    assert second.count == 1234
+    assert [r['result']['offset'] for r in requests] == [0, 0, 2]
+    assert shop.search_cache.stats()['hits'] == 2
+    assert shop.search_cache.stats()['hit_rate'] == 0.4
+
+    assert ShopApi.search_key({"a": 1, "b": 2}, {}) == ShopApi.search_key({"b": 2, "a": 1}, {})
+
+
+def test_search_cache_unchanged(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    shop.cache = Memcache()
+    monkeypatch.setattr(shop.config, 'cache', {'timeout': 60})
+
+    result = shop.search(session)
+    result.products.gather(0, 2)
+    result.products.gather(0, 2)
+
+    assert shop.cache.calls == ['get_multi', 'set_multi', 'get_multi']
+
+
+def test_search_cache_disabled(shop, session, mock):
+    mock('search/product_search.json')
+    shop.cache = Memcache()
+    shop.cache_search = False
+
+    result = shop.search(session)
+    result.products.gather(0, 2)
+
+    assert shop.cache.calls == []
+
+
+def test_prefetch(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    products = shop.search(session).products.gather(0, 2)
+
+    requests = []
+
+    def request(self, params):
+        requests.append(json.loads(params)[0]['products'])
+        return read('products/products-full.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    shop.prefetch(products, [PRODUCT_FIELD.DESCRIPTION_LONG, PRODUCT_FIELD.CATEGORIES])
+    shop.prefetch(products, [PRODUCT_FIELD.CATEGORIES])
+
+    assert len(requests) == 1
+    assert sorted(requests[0]['ids']) == [123, 456]
+    assert products[0].categories is not None
+
+
+def test_sibling_fetch(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    monkeypatch.setattr(shop.config, 'sibling_fetch', True)
+    p1, p2 = shop.search(session).products.gather(0, 2)
+
+    requests = []
+
+    def request(self, params):
+        requests.append(json.loads(params)[0]['products'])
+        return read('products/products-full.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    assert p1.categories is not None
+    assert p2.categories is not None
+    assert len(requests) == 1
+
+
+def test_no_siblings(shop, session, mock, monkeypatch):
+    mock('search/product_search.json')
+    monkeypatch.setattr(shop.config, 'sibling_fetch', False)
+    p1, p2 = shop.search(session).products.gather(0, 2)
+
+    assert p1._siblings is None
+
+
 def test_simple_colors(shop):
     result = shop.simple_colors()
 
@@ -113,6 +464,176 @@ class TestBasket:
 
         basket.set(variant, 1)
 
+    def test_update(self, shop, session, mock, monkeypatch):
+        basket = shop.basket(session)
+
+        mock('products/products-full.json')
+        products, with_error = shop.products_by_id([123, 456])
+        first, second, third = products[456].variants[:3]
+
+        mock('basket/basket.json')
+        basket.update({first: 2, second: 1})
+
+        requests = []
+
+        def request(self, params):
+            requests.append(json.loads(params)[0]['basket']['order_lines'])
+            return read('basket/basket.json')
+
+        monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+        basket.update({first: 1, second: 0, third: 1, products[456].variants[3]: 0})
+
+        assert len(requests) == 1
+        lines = requests[0]
+        assert len([line for line in lines if 'delete' in line]) == 2
+        assert [line['variant_id'] for line in lines if 'variant_id' in line] == [third.id]
+        assert basket.variants == {first: 1, third: 1}
+
+        basket.update({first: 1})
+        assert len(requests) == 1
+
+        assert basket.quantities() == {4719964: 5}
+
+    def test_optimistic_totals(self, session, mock, monkeypatch):
+        shop = ShopApi(credentials, Config(basket_pricing={'tax': 19.0}))
+        mismatches = []
+        shop.on_basket_mismatch = lambda basket, local, remote: mismatches.append((local, remote))
+
+        mock('products/products-full.json')
+        products, with_error = shop.products_by_id([456])
+        variant = products[456].variants[0]
+
+        answered = threading.Event()
+
+        def request(self, params):
+            answered.wait(5)
+            return read('basket/basket.json')
+
+        monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+        basket = shop.basket(session)
+        basket.update({variant: 2})
+
+        assert basket.total_price == 7980
+        assert basket.total_net == 6706
+        assert basket.total_vat == 1274
+
+        answered.set()
+        basket.wait()
+
+        assert basket.total_price == 89685
+        assert mismatches == [({'total_price': 7980, 'total_net': 6706, 'total_vat': 1274},
+                               {'total_price': 89685, 'total_net': 75369, 'total_vat': 14316})]
+
+    def test_optimistic_failure(self, session, mock, monkeypatch):
+        shop = ShopApi(credentials, Config(basket_pricing={'tax': 19.0}))
+        mismatches = []
+        shop.on_basket_mismatch = lambda basket, local, remote: mismatches.append((local, remote))
+
+        mock('products/products-full.json')
+        products, with_error = shop.products_by_id([456])
+        variant = products[456].variants[0]
+
+        mock('basket/basket-variant-not-found.json')
+        basket = shop.basket(session)
+        basket.update({variant: 2})
+
+        with raises(BasketException):
+            basket.wait()
+
+        assert basket.variants == {}
+        assert basket.total_price == 0
+        assert mismatches == [({'total_price': 7980, 'total_net': 6706, 'total_vat': 1274},
+                               {'total_price': 0, 'total_net': 0, 'total_vat': 0})]
+
+        requests = []
+
+        def request(self, params):
+            requests.append(json.loads(params)[0]['basket']['order_lines'])
+            return read('basket/basket.json')
+
+        monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+        basket.update({variant: 3})
+        basket.wait()
+
+        assert len(requests[0]) == 3
+
+        def request(self, params):
+            raise IOError("connection refused")
+
+        monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+        basket.update({variant: 1})
+
+        with raises(IOError):
+            basket.wait()
+
+        assert basket.variants == {variant: 3}
+        assert basket._totals is None
+
+    def test_optimistic_threads(self, session, mock, monkeypatch):
+        shop = ShopApi(credentials, Config(basket_pricing={'tax': 19.0}, basket_store={'type': 'memory'}))
+
+        mock('products/products-full.json')
+        products, with_error = shop.products_by_id([456])
+        variants = products[456].variants[:4]
+
+        mock('basket/basket.json')
+        basket = shop.basket(session)
+        done = threading.Event()
+        errors = []
+
+        def read_state():
+            while not done.is_set():
+                try:
+                    basket._state()
+                    basket.local_totals()
+                except Exception as ex:
+                    errors.append(ex)
+
+        reader = threading.Thread(target=read_state)
+        reader.start()
+
+        expected = {}
+
+        try:
+            for i in range(200):
+                basket.update({variants[i % 4]: i % 3})
+                expected[variants[i % 4]] = i % 3
+        finally:
+            basket.wait()
+            done.set()
+            reader.join()
+
+        assert errors == []
+        assert basket.variants == dict((v, c) for v, c in expected.items() if c)
+
+    def test_item_range(self):
+        items = ItemRange('abc-1')
+
+        items, new, old = items.resized(3)
+        assert new == ['abc-1-0', 'abc-1-1', 'abc-1-2']
+        assert old == []
+
+        items, new, old = items.resized(1)
+        assert new == []
+        assert old == ['abc-1-0', 'abc-1-1']
+        assert list(items) == ['abc-1-2']
+
+        items, new, old = items.resized(2)
+        assert new == ['abc-1-3']
+        assert len(items) == 2
+
+        items = ItemRange.from_ids(['x', 'abc-1-3', 'abc-1-2', 'def-2-0'])
+        assert (items.prefix, items.start, items.stop) == ('abc-1', 2, 4)
+        assert items.extra == ('x', 'def-2-0')
+
+        items, new, old = items.resized(1)
+        assert old == ['x', 'def-2-0', 'abc-1-2']
+        assert list(items) == ['abc-1-3']
+
     def test_remove(self, shop, session, mock):
         basket = shop.basket(session)
 
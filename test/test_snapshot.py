@@ -0,0 +1,51 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+from aboutyou.config import Config
+from aboutyou.shop import ShopApi
+from aboutyou.snapshot import Snapshot, SnapshotException, write_snapshot
+
+from pytest import raises
+
+from conftest import credentials
+
+
+def test_roundtrip(tmpdir):
+    path = str(tmpdir.join('snapshot'))
+
+    write_snapshot(path, {'tree': [{'id': 1}], 'app_id': 110})
+
+    snapshot = Snapshot(path)
+
+    assert 'tree' in snapshot
+    assert snapshot.section('tree') == [{'id': 1}]
+    assert snapshot.section('app_id') == 110
+    assert snapshot.section('missing') is None
+    assert 0 <= snapshot.age < 60
+
+    snapshot.close()
+
+
+def test_not_a_snapshot(tmpdir):
+    path = tmpdir.join('snapshot')
+    path.write(b'BZh91AY&SY' * 10, 'wb')
+
+    with raises(SnapshotException):
+        Snapshot(str(path))
+
+
+def test_shop_startup(shop, tmpdir, monkeypatch):
+    path = str(tmpdir.join('snapshot'))
+    shop.save_snapshot(path)
+
+    def request(self, params):
+        raise AssertionError("no request expected")
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    started = ShopApi(credentials, Config(snapshot={'path': path, 'refresh': False}))
+
+    assert [c.id for c in started.categories()] == [c.id for c in shop.categories()]
+    assert started.descendant_ids(200) == [210, 220]
+    assert len(started.facet_groups()) == len(shop.facet_groups())
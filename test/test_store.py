@@ -0,0 +1,120 @@
+#-*- coding: utf-8 -*-
+"""
+:Author:    Arne Simon [arne.simon@slice-dice.de]
+"""
+from aboutyou.config import Config
+from aboutyou.shop import ShopApi
+from aboutyou.store import MemoryStore, SQLiteStore, StoreConflict
+
+import json
+import pytest
+from pytest import raises
+
+from conftest import credentials, read
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryStore()
+
+    return SQLiteStore(str(tmpdir.join('baskets.db')))
+
+
+def test_cas(store):
+    assert store.get('s1') == (None, 0)
+
+    version = store.cas('s1', {'items': [1]}, 0)
+
+    assert store.get('s1') == ({'items': [1]}, version)
+
+    with raises(StoreConflict):
+        store.cas('s1', {'items': [2]}, 0)
+
+    version = store.cas('s1', {'items': [2]}, version)
+
+    assert store.get('s1') == ({'items': [2]}, version)
+
+    store.delete('s1')
+
+    assert store.get('s1') == (None, 0)
+
+
+def test_resume_basket(tmpdir, session, mock, monkeypatch):
+    config = Config(basket_store={'type': 'sqlite', 'path': str(tmpdir.join('baskets.db'))})
+    first = ShopApi(credentials, config)
+    second = ShopApi(credentials, config)
+
+    mock('products/products-full.json')
+    products, with_error = first.products_by_id([456])
+    variant = products[456].variants[0]
+
+    mock('basket/basket.json')
+    first.basket(session).update({variant: 2})
+
+    def request(self, params):
+        raise AssertionError("no request expected")
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    basket = second.basket(session)
+
+    assert basket.variants == {variant: 2}
+    assert basket.total_price == first.basket(session).total_price
+
+    requests = []
+
+    def request(self, params):
+        requests.append(json.loads(params)[0]['basket']['order_lines'])
+        return read('basket/basket.json')
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    basket.update({variant: 1})
+
+    assert len(requests[0]) == 1
+    assert first.basket(session).variants == {variant: 1}
+
+
+def test_concurrent_baskets(tmpdir, session, mock, monkeypatch):
+    config = Config(basket_store={'type': 'sqlite', 'path': str(tmpdir.join('baskets.db'))})
+    first = ShopApi(credentials, config)
+    second = ShopApi(credentials, config)
+
+    mock('products/products-full.json')
+    products, with_error = first.products_by_id([456])
+    one, two = products[456].variants[:2]
+
+    lines = []
+
+    def request(self, params):
+        # a basket of the Api, which applies every change
+        for line in json.loads(params)[0]['basket'].get('order_lines', []):
+            if 'delete' in line:
+                lines[:] = [l for l in lines if l['id'] != line['delete']]
+            else:
+                lines.append(line)
+
+        basket = {'order_lines': list(lines), 'products': {},
+                  'total_price': 0, 'total_net': 0, 'total_vat': 0}
+
+        return json.dumps([{'basket': basket}])
+
+    monkeypatch.setattr("aboutyou.api.Api.request", request)
+
+    first_basket = first.basket(session)
+    second_basket = second.basket(session)
+
+    # both processes resumed the same version
+    monkeypatch.setattr(second_basket, '_sync', lambda: None)
+
+    first_basket.update({one: 1})
+    second_basket.update({two: 1})
+
+    assert len(set(line['id'] for line in lines)) == 2
+    assert second_basket.variants == {one: 1, two: 1}
+    assert first.basket(session).variants == {one: 1, two: 1}
+
+    first.basket(session).update({one: 2})
+
+    assert len(set(line['id'] for line in lines)) == 3